@@ -0,0 +1,165 @@
+# admission.py
+"""
+Admission control for AI generation and TTS.
+
+A controller tracks in-flight work and queue depth against a nominal
+capacity and reports a load level:
+
+  normal    – everything runs as requested
+  degraded  – load > DEGRADE_AT x capacity, i.e. work is actually waiting
+              behind a full pool: gpt-4-turbo turns drop to the faster model
+              with fewer tokens, background summaries are deferred
+  shedding  – load >= SHED_AT x capacity: replies are capped harder and new
+              TTS streams are refused with 503 + Retry-After
+
+Run `python admission.py` for a simulated overload test comparing latency
+percentiles with and without admission control.
+"""
+import threading
+
+NORMAL, DEGRADED, SHEDDING = "normal", "degraded", "shedding"
+
+DEGRADE_AT = 1.0    # (in flight + queued) / capacity; strictly above, so a full pool alone stays normal
+SHED_AT    = 2.0
+
+FAST_MODEL = "gpt-3.5-turbo"
+DEGRADED_MAX_TOKENS = 300
+SHEDDING_MAX_TOKENS = 150
+
+
+class AdmissionController:
+    def __init__(self, name, capacity, degrade_at=DEGRADE_AT, shed_at=SHED_AT):
+        self.name = name
+        self.capacity = capacity
+        self.degrade_at = degrade_at
+        self.shed_at = shed_at
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.counters = {"admitted": 0, "degraded": 0, "shed": 0, "deferred": 0}
+
+    # ── gauges ──────────────────────────────────────────────────────────────
+    def enqueue(self):
+        with self.lock:
+            self.queued += 1
+
+    def start(self):
+        with self.lock:
+            self.queued = max(self.queued - 1, 0)
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+
+    def finish(self):
+        with self.lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+
+    def load(self):
+        return (self.in_flight + self.queued) / self.capacity
+
+    def level(self):
+        load = self.load()
+        if load >= self.shed_at:
+            return SHEDDING
+        if load > self.degrade_at:
+            return DEGRADED
+        return NORMAL
+
+    # ── policies ────────────────────────────────────────────────────────────
+    def adjust(self, model, max_tokens):
+        """Model and token limit to actually use for a live turn at the current load."""
+        level = self.level()
+        if level == NORMAL:
+            return model, max_tokens
+        with self.lock:
+            self.counters["degraded"] += 1
+        cap = SHEDDING_MAX_TOKENS if level == SHEDDING else DEGRADED_MAX_TOKENS
+        return FAST_MODEL, min(max_tokens, cap)
+
+    def allow_background(self):
+        """False while loaded; callers should defer background work."""
+        if self.level() == NORMAL:
+            return True
+        with self.lock:
+            self.counters["deferred"] += 1
+        return False
+
+    def try_admit(self):
+        """Start a unit of work unless we're shedding. Pair with finish()."""
+        with self.lock:
+            if (self.in_flight + self.queued) / self.capacity >= self.shed_at:
+                self.counters["shed"] += 1
+                return False
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "capacity": self.capacity,
+                "load": round((self.in_flight + self.queued) / self.capacity, 2),
+                "level": self.level(),
+                **self.counters,
+            }
+
+
+# ─── OVERLOAD SIMULATION ────────────────────────────────────────────────────
+if __name__ == "__main__":
+    import heapq
+    import random
+
+    WORKERS   = 8
+    DURATION  = 600.0                                   # simulated seconds
+    SERVICE_S = {"gpt-4-turbo": 4.0, FAST_MODEL: 1.2}   # mean seconds per reply
+    TOKEN_SCALE = lambda tokens: 0.5 + 0.5 * tokens / 600
+
+    def simulate(arrival_rate, controlled, seed=7):
+        rng = random.Random(seed)
+        ctl = AdmissionController("sim", WORKERS)
+        events = []             # (time, kind, payload)
+        t = 0.0
+        while t < DURATION:
+            t += rng.expovariate(arrival_rate)
+            heapq.heappush(events, (t, "arrive", None))
+        waiting, free, latencies = [], WORKERS, []
+
+        def begin(now, arrived):
+            nonlocal free
+            free -= 1
+            ctl.start()
+            model, tokens = "gpt-4-turbo", 600
+            if controlled:
+                model, tokens = ctl.adjust(model, tokens)
+            service = rng.expovariate(1 / SERVICE_S[model]) * TOKEN_SCALE(tokens)
+            heapq.heappush(events, (now + service, "done", arrived))
+
+        while events:
+            now, kind, arrived = heapq.heappop(events)
+            if kind == "arrive":
+                ctl.enqueue()
+                if free:
+                    begin(now, now)
+                else:
+                    waiting.append(now)
+            else:
+                ctl.finish()
+                free += 1
+                latencies.append(now - arrived)
+                if waiting:
+                    begin(now, waiting.pop(0))
+
+        latencies.sort()
+        pct = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+        return len(latencies), pct(0.5), pct(0.99), ctl.counters["degraded"]
+
+    capacity = WORKERS / SERVICE_S["gpt-4-turbo"]
+    print(f"{WORKERS} workers, nominal capacity {capacity:.1f} turns/s at gpt-4-turbo")
+    for overload in (0.8, 1.5, 2.5, 4.0):
+        rate = capacity * overload
+        for controlled in (False, True):
+            n, p50, p99, degraded = simulate(rate, controlled)
+            label = "admission" if controlled else "no control"
+            print(f"  {overload:.1f}x load, {label:>10}: {n} turns, p50 {p50:6.1f}s, "
+                  f"p99 {p99:6.1f}s, degraded {degraded}")
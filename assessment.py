@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from supabase import create_client
 import uuid
 import datetime
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
 from .db import supabase_admin  # Admin client to bypass RLS
 
 router = APIRouter()
@@ -31,38 +38,170 @@ class AssessmentWithQuestions(BaseModel):
     name: str
     questions: List[AssessmentQuestion]
 
+class TrendPoint(BaseModel):
+    score: int
+    submitted_at: str
+
+class AssessmentTrend(BaseModel):
+    assessment_id: str
+    assessment_name: str
+    latest_score: int
+    delta: Optional[int]
+    rolling_avg: float
+    result_text: Optional[str]
+    submissions: int
+    recent: List[TrendPoint]
+    updated_at: str
+
 class AnswerSubmission(BaseModel):
     user_id: str
     conversation_id: Optional[str]
     answers: List[dict]  # Each dict: {"question_id": str, "value": int, "label": str}
 
+# --- Catalog Cache ---
+# Assessments and their questions almost never change, so we load the whole
+# catalog once, pre-serialize every response body and serve it from memory.
+# The cache is refreshed after CATALOG_TTL_SECONDS or when a realtime change
+# on either table calls invalidate_catalog(). Refreshes run in the background;
+# requests keep getting the previous version until the new one is swapped in.
+
+CATALOG_TTL_SECONDS = 300
+
+class _Catalog:
+    def __init__(self, version: int, assessments: List[Assessment], by_id: Dict[str, AssessmentWithQuestions]):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.list_body, self.list_etag = _encode(assessments)
+        self.questions: Dict[str, tuple] = {aid: _encode(a) for aid, a in by_id.items()}
+        self.names: Dict[str, str] = {aid: a.name for aid, a in by_id.items()}
+
+def _encode(model) -> tuple:
+    body = json.dumps(jsonable_encoder(model), separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return body, etag
+
+_catalog: Optional[_Catalog] = None
+_catalog_lock = threading.Lock()
+_catalog_reload_lock = threading.Lock()
+_catalog_stale = False
+_catalog_refreshing = False
+_catalog_channel = None   # realtime subscription kept alive for the process
+
+def load_catalog() -> _Catalog:
+    """Fetch both catalog tables in two queries and swap in a new version."""
+    global _catalog, _catalog_stale
+    with _catalog_reload_lock:
+        rows = supabase_admin.table("assessments").select("*").execute().data or []
+        qrows = supabase_admin.table("assessment_questions").select("*") \
+            .order("assessment_id").order("question_number").execute().data or []
+
+        grouped: Dict[str, List[AssessmentQuestion]] = {}
+        for q in qrows:
+            grouped.setdefault(q["assessment_id"], []).append(AssessmentQuestion(**q))
+
+        assessments = [Assessment(**r) for r in rows]
+        by_id = {
+            r["id"]: AssessmentWithQuestions(id=r["id"], name=r["name"], questions=grouped.get(r["id"], []))
+            for r in rows
+        }
+        version = (_catalog.version + 1) if _catalog else 1
+        _catalog = _Catalog(version, assessments, by_id)
+        _catalog_stale = False
+        print(f"📚 Loaded assessment catalog v{version}: {len(rows)} assessments, {len(qrows)} questions")
+        return _catalog
+
+def invalidate_catalog(*_args):
+    """Mark the catalog stale; the next request triggers a reload. Safe as a realtime callback."""
+    global _catalog_stale, _rules
+    _catalog_stale = True
+    _rules = None
+
+def _catalog_expired(cat: Optional[_Catalog]) -> bool:
+    return cat is None or _catalog_stale or time.monotonic() - cat.loaded_at > CATALOG_TTL_SECONDS
+
+def _refresh_catalog_in_background():
+    global _catalog_refreshing
+    with _catalog_lock:
+        if _catalog_refreshing:
+            return
+        _catalog_refreshing = True
+
+    def run():
+        global _catalog_refreshing
+        try:
+            load_catalog()
+        except Exception as e:
+            print("❌ Failed to refresh assessment catalog:", e)
+        finally:
+            _catalog_refreshing = False
+
+    threading.Thread(target=run, name="catalog-refresh", daemon=True).start()
+
+def get_catalog() -> _Catalog:
+    cat = _catalog
+    if cat is None:
+        # nothing to serve yet: the first request waits for the load
+        with _catalog_lock:
+            return _catalog or load_catalog()
+    if _catalog_expired(cat):
+        _refresh_catalog_in_background()
+    return cat
+
+async def watch_catalog_changes(supabase_async):
+    """Subscribe to assessment table changes so edits show up before the TTL expires."""
+    channel = supabase_async.channel("assessment_catalog_changes")
+    for table in ("assessments", "assessment_questions", "assessment_score_bands"):
+        channel.on_postgres_changes(event="*", schema="public", table=table, callback=invalidate_catalog)
+    await channel.subscribe()
+    return channel
+
+def _cached_response(request: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in (request.headers.get("if-none-match") or ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.on_event("startup")
+def warm_catalog():
+    try:
+        load_catalog()
+        reload_scoring_rules()
+    except Exception as e:
+        print("❌ Failed to preload assessment catalog:", e)
+
+@router.on_event("startup")
+async def subscribe_catalog_changes():
+    global _catalog_channel
+    try:
+        from supabase._async.client import create_client as create_client_async
+        client = await create_client_async(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"])
+        _catalog_channel = await watch_catalog_changes(client)
+    except Exception as e:
+        # the TTL still bounds staleness without realtime
+        print("❌ Failed to subscribe to assessment catalog changes:", e)
+
 # --- Routes ---
 
 @router.get("/api/assessments", response_model=List[Assessment])
-def get_assessments():
-    response = supabase_admin.table("assessments").select("*").execute()
-    if not response.data:
+def get_assessments(request: Request):
+    cat = get_catalog()
+    if cat.list_body == b"[]":
         raise HTTPException(status_code=404, detail="No assessments found")
-    return response.data
+    return _cached_response(request, cat.list_body, cat.list_etag)
 
 @router.get("/api/assessments/{assessment_id}/questions", response_model=AssessmentWithQuestions)
-def get_questions(assessment_id: str):
-    assessment_res = supabase_admin.table("assessments").select("*").eq("id", assessment_id).single().execute()
-    if not assessment_res.data:
+def get_questions(assessment_id: str, request: Request):
+    entry = get_catalog().questions.get(assessment_id)
+    if entry is None:
         raise HTTPException(status_code=404, detail="Assessment not found")
-
-    questions_res = supabase_admin.table("assessment_questions").select("*").eq("assessment_id", assessment_id).order("question_number").execute()
-    return {
-        "id": assessment_res.data["id"],
-        "name": assessment_res.data["name"],
-        "questions": questions_res.data or []
-    }
+    return _cached_response(request, *entry)
 
 @router.post("/api/assessments/{assessment_id}/submit")
 def submit_assessment(assessment_id: str, submission: AnswerSubmission):
-    score = sum(ans["value"] for ans in submission.answers)
-    result_text = interpret_score(assessment_id, score)
+    scored = score_answers(assessment_id, submission.answers)
+    score, result_text = scored["score"], scored["result_text"]
     result_id = str(uuid.uuid4())
+    submitted_at = datetime.datetime.utcnow().isoformat()
 
     supabase_admin.table("assessment_results").insert({
         "id": result_id,
@@ -71,7 +210,7 @@ def submit_assessment(assessment_id: str, submission: AnswerSubmission):
         "conversation_id": submission.conversation_id,
         "score": score,
         "result_text": result_text,
-        "submitted_at": datetime.datetime.utcnow().isoformat()
+        "submitted_at": submitted_at
     }).execute()
 
     for ans in submission.answers:
@@ -83,27 +222,210 @@ def submit_assessment(assessment_id: str, submission: AnswerSubmission):
             "answer_label": ans["label"]
         }).execute()
 
-    return {"result_id": result_id, "score": score, "result_text": result_text}
+    try:
+        update_trend(submission.user_id, assessment_id, score, result_text, submitted_at)
+    except Exception as e:
+        # the result is stored; a stale trend row is not worth failing the submission
+        print(f"❌ Failed to update trend for {submission.user_id}/{assessment_id}:", e)
+
+    return {
+        "result_id": result_id,
+        "score": score,
+        "result_text": result_text,
+        "subscales": scored["subscales"],
+    }
+
+def caller_id(request: Request) -> str:
+    """Supabase user id behind the request's bearer token; 401 without a valid one."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    try:
+        user = supabase_admin.auth.get_user(token).user
+    except Exception:
+        user = None
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return user.id
+
+@router.get("/api/assessments/trends/{user_id}", response_model=List[AssessmentTrend])
+def get_trends(user_id: str, request: Request):
+    # read with the service role, so enforce the table's own-rows policy here
+    if caller_id(request) != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed to read this patient's trends")
+    return supabase_admin.table("assessment_trends").select("*") \
+        .eq("user_id", user_id).order("updated_at", desc=True).execute().data or []
+
+@router.post("/api/assessments/{assessment_id}/rescore")
+def rescore_assessment(assessment_id: str):
+    """Re-apply the current scoring rules to every stored result of an assessment."""
+    reload_scoring_rules()
+    return rescore_results(assessment_id)
+
+# --- Scoring Engine ---
+# Band thresholds, subscales and reverse-scored items live in the database
+# (assessment_score_bands + assessment_questions.subscale/reverse_scored).
+# They are loaded once and compiled into sorted threshold arrays, so a
+# score is interpreted with a single bisect.
+
+UNAVAILABLE = "Score Interpretation Unavailable"
+RESCORE_BATCH_SIZE = 500
+
+class _Bands:
+    def __init__(self, rows: List[dict]):
+        rows = sorted(rows, key=lambda r: r["min_score"])
+        self.thresholds = [r["min_score"] for r in rows]
+        self.labels = [r["label"] for r in rows]
+
+    def label(self, score: int) -> str:
+        i = bisect.bisect_right(self.thresholds, score) - 1
+        return self.labels[i] if i >= 0 else UNAVAILABLE
+
+class _Rules:
+    def __init__(self):
+        self.bands: Dict[Optional[str], _Bands] = {}   # None = total score
+        self.subscale_of: Dict[str, str] = {}          # question_id -> subscale
+        self.reverse: Dict[str, int] = {}              # question_id -> min+max option value
+
+_rules: Optional[Dict[str, _Rules]] = None
+_rules_lock = threading.Lock()
+
+def reload_scoring_rules() -> Dict[str, _Rules]:
+    global _rules
+    with _rules_lock:
+        bands = supabase_admin.table("assessment_score_bands") \
+            .select("assessment_id,subscale,min_score,label").execute().data or []
+        questions = supabase_admin.table("assessment_questions") \
+            .select("id,assessment_id,subscale,reverse_scored,answer_options").execute().data or []
+
+        by_scale: Dict[tuple, List[dict]] = {}
+        for b in bands:
+            by_scale.setdefault((b["assessment_id"], b.get("subscale")), []).append(b)
+
+        compiled: Dict[str, _Rules] = {}
+        for (aid, subscale), rows in by_scale.items():
+            compiled.setdefault(aid, _Rules()).bands[subscale] = _Bands(rows)
+        for q in questions:
+            rules = compiled.setdefault(q["assessment_id"], _Rules())
+            if q.get("subscale"):
+                rules.subscale_of[q["id"]] = q["subscale"]
+            if q.get("reverse_scored"):
+                values = [o["value"] for o in q.get("answer_options") or []]
+                if values:
+                    rules.reverse[q["id"]] = min(values) + max(values)
+
+        _rules = compiled
+        print(f"🧮 Loaded scoring rules for {len(compiled)} assessments")
+        return compiled
+
+def _get_rules(assessment_id: str) -> _Rules:
+    rules = _rules if _rules is not None else reload_scoring_rules()
+    return rules.get(assessment_id) or _Rules()
+
+def score_answers(assessment_id: str, answers: List[dict]) -> dict:
+    """
+    Score one submission. Each answer needs "question_id" and "value".
+    Returns the total score, its label, and a {subscale: {score, result_text}} map.
+    """
+    rules = _get_rules(assessment_id)
+    total = 0
+    sub_totals: Dict[str, int] = {}
+    for ans in answers:
+        qid, value = ans["question_id"], ans["value"]
+        if qid in rules.reverse:
+            value = rules.reverse[qid] - value
+        total += value
+        subscale = rules.subscale_of.get(qid)
+        if subscale:
+            sub_totals[subscale] = sub_totals.get(subscale, 0) + value
+
+    overall = rules.bands.get(None)
+    subscales = {}
+    for name, sub_score in sub_totals.items():
+        bands = rules.bands.get(name)
+        subscales[name] = {
+            "score": sub_score,
+            "result_text": bands.label(sub_score) if bands else UNAVAILABLE,
+        }
+    return {
+        "score": total,
+        "result_text": overall.label(total) if overall else UNAVAILABLE,
+        "subscales": subscales,
+    }
+
+def rescore_results(assessment_id: str) -> dict:
+    """
+    Re-score stored assessment_results in batches and upsert only the rows
+    whose score or label changed.
+    """
+    scanned = changed = 0
+    offset = 0
+    affected_users = set()
+    while True:
+        results = supabase_admin.table("assessment_results").select("*") \
+            .eq("assessment_id", assessment_id).order("submitted_at") \
+            .range(offset, offset + RESCORE_BATCH_SIZE - 1).execute().data or []
+        if not results:
+            break
+
+        answers = supabase_admin.table("assessment_answers") \
+            .select("result_id,question_id,answer_value") \
+            .in_("result_id", [r["id"] for r in results]).execute().data or []
+        by_result: Dict[str, List[dict]] = {}
+        for a in answers:
+            by_result.setdefault(a["result_id"], []).append(
+                {"question_id": a["question_id"], "value": a["answer_value"]}
+            )
+
+        updates = []
+        for row in results:
+            scored = score_answers(assessment_id, by_result.get(row["id"], []))
+            if (scored["score"], scored["result_text"]) != (row["score"], row["result_text"]):
+                updates.append({**row, "score": scored["score"], "result_text": scored["result_text"]})
+                affected_users.add(row["user_id"])
+        if updates:
+            supabase_admin.table("assessment_results").upsert(updates).execute()
+
+        scanned += len(results)
+        changed += len(updates)
+        offset += RESCORE_BATCH_SIZE
+
+    # trend rows (and the prompt's trend line) carry the latest score and label
+    trends = 0
+    if affected_users:
+        trends = supabase_admin.rpc("rebuild_assessment_trends", {
+            "p_assessment_id": assessment_id,
+            "p_user_ids": sorted(affected_users),
+            "p_window": TREND_WINDOW,
+        }).execute().data or 0
+
+    print(f"🧮 Re-scored {scanned} results for assessment {assessment_id}, {changed} changed, {trends} trends rebuilt")
+    return {"scanned": scanned, "changed": changed, "trends_rebuilt": trends}
+
+# --- Trends ---
+# assessment_trends holds one row per (patient, instrument) with the latest
+# score, its delta and a rolling average over the last TREND_WINDOW
+# submissions, so readers never scan assessment_results. The row is updated
+# in SQL under a row lock (record_assessment_trend), so concurrent
+# submissions for the same patient and instrument can't lose an update.
+
+TREND_WINDOW = 5
+
+def update_trend(user_id: str, assessment_id: str, score: int, result_text: str, submitted_at: str) -> dict:
+    return supabase_admin.rpc("record_assessment_trend", {
+        "p_user_id": user_id,
+        "p_assessment_id": assessment_id,
+        "p_assessment_name": get_catalog().names.get(assessment_id, assessment_id),
+        "p_score": score,
+        "p_result_text": result_text,
+        "p_submitted_at": submitted_at,
+        "p_window": TREND_WINDOW,
+    }).execute().data
 
-# --- Utility: Interpretation ---
 def interpret_score(assessment_id: str, score: int) -> str:
-    key = assessment_id.lower()
-    if "phq" in key:
-        if score >= 20: return "Severe Depression"
-        elif score >= 15: return "Moderately Severe Depression"
-        elif score >= 10: return "Moderate Depression"
-        elif score >= 5: return "Mild Depression"
-        else: return "Minimal Depression"
-    elif "gad" in key:
-        if score >= 15: return "Severe Anxiety"
-        elif score >= 10: return "Moderate Anxiety"
-        elif score >= 5: return "Mild Anxiety"
-        else: return "Minimal Anxiety"
-    elif "kessler" in key or "k6" in key:
-        if score >= 13: return "Serious psychological distress"
-        elif score >= 8: return "Moderate distress"
-        else: return "Low distress"
-    return "Score Interpretation Unavailable"
+    bands = _get_rules(assessment_id).bands.get(None)
+    return bands.label(score) if bands else UNAVAILABLE
 
 # You can include this router in your main app as:
 # app.include_router(assessment.router)
+# Its startup hooks preload the catalog and subscribe to catalog edits.
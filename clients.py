@@ -0,0 +1,124 @@
+# clients.py
+"""
+Shared, lazily created clients for the worker and the API services.
+
+Importing this module is cheap: nothing is constructed, no SDK is imported
+and no secret is required until a client is first used. Each client is a
+thread-safe singleton behind a proxy, so callers keep writing
+`supabase.table(...)` / `openai_client.chat...` as before.
+
+Run `python clients.py` to measure import time and peak memory of each
+entry point in a fresh interpreter.
+"""
+import os
+import threading
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def load_env():
+    """Load .env once. Cheap and safe to call from any module at import time."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            try:
+                from dotenv import load_dotenv
+                load_dotenv()
+            except ImportError:
+                pass
+            _env_loaded = True
+
+
+def require_env(name):
+    load_env()
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(f"{name} is not set")
+    return value
+
+
+class Lazy:
+    """Proxy that builds its target on first attribute access (double-checked, thread-safe)."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+        self._lock = threading.Lock()
+
+    # private name: a public `get` would shadow the target's own (requests.Session.get)
+    def _resolve(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+        return self._obj
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+# ─── FACTORIES ───────────────────────────────────────────────────────────────
+def _make_supabase():
+    from supabase import create_client
+    return create_client(require_env("SUPABASE_URL"), require_env("SUPABASE_SERVICE_ROLE_KEY"))
+
+
+def _make_openai():
+    from openai import OpenAI
+    # retries are handled by the shared rate limiter, which honours Retry-After
+    return OpenAI(api_key=require_env("OPENAI_API_KEY"), max_retries=0)
+
+
+def _make_eleven_session():
+    import requests
+    sess = requests.Session()
+    sess.headers.update({
+        "xi-api-key": require_env("ELEVENLABS_API_KEY"),
+        "Content-Type": "application/json",
+    })
+    return sess
+
+
+def _make_storage_session():
+    import requests
+    return requests.Session()
+
+
+async def create_supabase_async():
+    """Async client, used only for realtime subscriptions."""
+    from supabase._async.client import create_client as create_client_async
+    return await create_client_async(require_env("SUPABASE_URL"), require_env("SUPABASE_SERVICE_ROLE_KEY"))
+
+
+supabase       = Lazy(_make_supabase)
+supabase_admin = Lazy(_make_supabase)
+openai_client  = Lazy(_make_openai)
+eleven_sess    = Lazy(_make_eleven_session)
+storage_sess   = Lazy(_make_storage_session)
+
+
+# ─── STARTUP BENCHMARK ──────────────────────────────────────────────────────
+if __name__ == "__main__":
+    import subprocess
+    import sys
+
+    PROBE = (
+        "import resource, sys, time\n"
+        "t = time.perf_counter()\n"
+        "import {module}\n"
+        "elapsed = (time.perf_counter() - t) * 1000\n"
+        "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "rss_mb = rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024\n"
+        "print(f'{{elapsed:.0f}} ms, {{rss_mb:.1f}} MB peak RSS')\n"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in ("worker", "summarizer_api", "tts_stream_api"):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module)],
+            cwd=here, capture_output=True, text=True,
+        )
+        result = out.stdout.strip() or out.stderr.strip().splitlines()[-1]
+        print(f"{module:>15}: {result}")
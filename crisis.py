@@ -0,0 +1,144 @@
+# crisis.py
+"""
+Local self-harm / suicide pre-screen that runs on every user turn before
+the LLM is called.
+
+All lexicon patterns are compiled into a single alternation, so a screen
+is one regex scan over the normalized text (a few microseconds per
+message). The lexicon can be replaced with a JSON file through
+CRISIS_LEXICON_PATH: {"patterns": [...], "exclude": [...]}, both lists of
+regex fragments.
+
+Run `python crisis.py` to benchmark the screen and report precision and
+recall on crisis_corpus.jsonl. The corpus deliberately includes everyday
+phrasings the lexicon doesn't encode: the screen is a fast first pass, and
+the model's handle_suicidal_mention function remains the backstop for
+what it misses. Exclusions drop other people's deaths ("my cousin died by
+suicide"), third-person mentions and topical uses ("suicide prevention")
+before matching, so a disclosure elsewhere in the same message still
+matches.
+"""
+import json
+import os
+import re
+import time
+
+from clients import load_env
+
+load_env()
+
+CRISIS_HOTLINE = os.getenv("CRISIS_HOTLINE", "988")
+
+CRISIS_RESPONSE = (
+    "I'm really sorry you're going through this, and I'm glad you told me. "
+    "Your safety matters most right now. If you're thinking about harming yourself, "
+    f"please call or text {CRISIS_HOTLINE} to reach the Suicide and Crisis Lifeline, "
+    "or contact your local emergency number. Reaching out to someone you trust, "
+    "or getting in-person support today, can really help. I'm here with you."
+)
+
+DEFAULT_LEXICON = {
+    "patterns": [
+        r"suicid(?:e|al)",
+        r"kill(?:ing)? my ?self",
+        r"kms",
+        r"end(?:ing)? (?:my|it) (?:own )?(?:life|all)",
+        r"take my (?:own )?life",
+        r"(?:want|wanna|going|ready) to die",
+        r"wish i (?:was|were) dead",
+        r"better off (?:dead|without me)",
+        r"(?:don'?t|do not) want to (?:live|be alive|exist|be here)",
+        r"no (?:reason|point) (?:to|in) (?:live|living|go on|going on)",
+        r"what(?:'s| is) the (?:point|use) (?:of|in) (?:living|life|being alive|going on)",
+        r"(?:hurt|harm|cut|cutting|hurting|harming) my ?self",
+        r"self[- ]?harm(?:ing)?",
+        r"overdos(?:e|ed|ing)",
+        r"hang(?:ing)? my ?self",
+        r"(?:not|won'?t) (?:be|being) (?:here|around) anymore",
+        r"can'?t go on",
+    ],
+    # idioms, other people's deaths and topical mentions that contain a
+    # pattern but aren't the writer's own disclosure
+    "exclude": [
+        r"suicide squad",
+        r"(?:going|want|wanna) to die (?:of|from) (?:laughter|embarrassment|boredom)",
+        r"(?:died|dies|death|deaths|lost (?:him|her|them)) (?:by|to|of|from) (?:suicide|an? overdose|overdoses?)",
+        r"(?:suicide|self[- ]?harm|overdose) (?:prevention|awareness|hotlines?|rates?|statistics|numbers|deaths|research)",
+        r"(?:he|she|they|someone|somebody|(?:my|our|his|her|their) (?:\w+'s )?\w+) (?:(?!i )\w+ )?(?:overdosed|attempted suicide|committed suicide)",
+    ],
+}
+
+_APOSTROPHES = re.compile(r"[’‘`]")
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(text):
+    text = _APOSTROPHES.sub("'", text.lower())
+    return _SPACES.sub(" ", text)
+
+
+def _compile(fragments):
+    if not fragments:
+        return None
+    return re.compile(r"\b(?:" + "|".join(f"(?:{f})" for f in fragments) + r")\b")
+
+
+def load_lexicon(path=None):
+    path = path or os.getenv("CRISIS_LEXICON_PATH")
+    if not path:
+        return DEFAULT_LEXICON
+    with open(path) as f:
+        return json.load(f)
+
+
+class CrisisScreen:
+    def __init__(self, lexicon=None):
+        lexicon = lexicon or load_lexicon()
+        self.pattern = _compile(lexicon.get("patterns", []))
+        self.exclude = _compile(lexicon.get("exclude", []))
+
+    def screen(self, text):
+        """Return the matched phrase if `text` looks like a crisis disclosure, else None."""
+        if not text or self.pattern is None:
+            return None
+        norm = _normalize(text)
+        if self.exclude is not None:
+            norm = self.exclude.sub(" ", norm)
+        m = self.pattern.search(norm)
+        return m.group(0) if m else None
+
+
+screen = CrisisScreen().screen
+
+
+# ─── BENCHMARK ──────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis_corpus.jsonl")
+    with open(corpus_path) as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    tp = fp = fn = tn = 0
+    for item in corpus:
+        flagged = screen(item["text"]) is not None
+        if flagged and item["crisis"]:
+            tp += 1
+        elif flagged:
+            fp += 1
+            print("  false positive:", item["text"])
+        elif item["crisis"]:
+            fn += 1
+            print("  false negative:", item["text"])
+        else:
+            tn += 1
+
+    rounds = 2_000
+    texts = [item["text"] for item in corpus]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for t in texts:
+            screen(t)
+    per_call_us = (time.perf_counter() - started) / (rounds * len(texts)) * 1e6
+
+    print(f"corpus: {len(corpus)} messages ({tp + fn} crisis)")
+    print(f"precision: {tp / max(tp + fp, 1):.3f}  recall: {tp / max(tp + fn, 1):.3f}")
+    print(f"screen latency: {per_call_us:.2f} µs/message")
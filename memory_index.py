@@ -0,0 +1,235 @@
+# memory_index.py
+"""
+Cross-session semantic memory.
+
+When a session ends, its key moments are summarized into a few one-line
+chunks, embedded in one batched call and stored in memory_chunks. Each
+patient's chunks are held in memory as an L2-normalized NumPy matrix, so
+cosine top-k for a query is a single matrix product; new sessions are
+appended in place without reloading. Sessions indexed by another process
+(e.g. summarizer_api's /cleanup_inactive) are picked up by checking for
+newer rows at most every MEMORY_REFRESH_S, fetching only those.
+
+build_chat_payload calls `recall(patient_id, text)` to pull the few most
+relevant past moments into the prompt within MEMORY_TOKEN_BUDGET.
+"""
+import importlib
+import threading
+import time
+from collections import OrderedDict
+
+from clients import Lazy, openai_client, supabase
+from ratelimit import limiter, estimate_tokens, CHAT, BACKGROUND
+import usage
+
+EMBED_MODEL         = "text-embedding-3-small"
+MEMORY_TOP_K        = 4
+MEMORY_MIN_SCORE    = 0.30      # cosine similarity below this isn't "relevant"
+MEMORY_TOKEN_BUDGET = 250       # prompt tokens we'll spend on recalled moments
+MAX_MOMENTS         = 8         # chunks produced per ended session
+MAX_PATIENTS        = 1000      # patient matrices kept in memory
+MEMORY_REFRESH_S    = 60        # how often a cached patient checks for chunks from other processes
+
+# worker imports this module, and so does everything that imports worker;
+# numpy is only loaded once a memory is actually indexed or recalled
+np = Lazy(lambda: importlib.import_module("numpy"))
+
+MOMENTS_PROMPT = """
+You are summarizing a therapy session for the therapist's private notes.
+List up to {n} distinct key moments: what the client shared, felt or decided.
+One short sentence per line, no numbering, no preamble.
+""".strip()
+
+
+def embed(texts, priority=BACKGROUND, purpose="memory_embed"):
+    """Embed a batch of texts; returns an L2-normalized float32 matrix (len(texts) x dim)."""
+    resp = limiter.call(
+        "openai", EMBED_MODEL, priority, openai_client.embeddings.create,
+        tokens=sum(len(t) for t in texts) // 4,
+        model=EMBED_MODEL,
+        input=texts,
+    )
+    usage.record_openai(resp, EMBED_MODEL, purpose)
+    vectors = np.array([d.embedding for d in resp.data], dtype=np.float32)
+    return _normalize(vectors)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class PatientIndex:
+    """Growable matrix of one patient's chunk embeddings (capacity doubles on append)."""
+
+    def __init__(self, texts, vectors, ids=(), newest=None):
+        self.lock = threading.Lock()
+        self.texts = list(texts)
+        self.size = len(self.texts)
+        self.ids = set(ids)         # memory_chunks ids already in the matrix
+        self.newest = newest        # created_at of the newest chunk seen
+        self.checked = time.monotonic()
+        dim = vectors.shape[1] if self.size else 0
+        self.matrix = np.zeros((max(self.size, 16), dim), dtype=np.float32)
+        if self.size:
+            self.matrix[:self.size] = vectors
+
+    def append(self, texts, vectors, ids=(), newest=None):
+        with self.lock:
+            if ids:
+                fresh = [i for i, cid in enumerate(ids) if cid not in self.ids]
+                if not fresh:
+                    return
+                texts, vectors = [texts[i] for i in fresh], vectors[fresh]
+                self.ids.update(ids)
+            if newest and (self.newest is None or newest > self.newest):
+                self.newest = newest
+            if self.size == 0 and self.matrix.shape[1] != vectors.shape[1]:
+                # first chunks for this patient: adopt the embedding width
+                self.matrix = np.zeros((max(16, len(texts)), vectors.shape[1]), dtype=np.float32)
+            needed = self.size + len(texts)
+            if needed > len(self.matrix):
+                grown = np.zeros((max(needed, 2 * len(self.matrix)), self.matrix.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.matrix[:self.size]
+                self.matrix = grown
+            self.matrix[self.size:needed] = vectors
+            self.texts.extend(texts)
+            self.size = needed
+
+    def search(self, queries, k=MEMORY_TOP_K):
+        """
+        Batched cosine top-k. `queries` is an (m x dim) normalized matrix;
+        returns one [(score, text), ...] list per query, best first.
+        """
+        with self.lock:
+            matrix, texts, n = self.matrix[:self.size], self.texts, self.size
+        if n == 0:
+            return [[] for _ in range(len(queries))]
+        scores = queries @ matrix.T                  # (m x n)
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, idx in zip(scores, top):
+            idx = idx[np.argsort(-row[idx])]
+            results.append([(float(row[i]), texts[i]) for i in idx])
+        return results
+
+
+class MemoryIndex:
+    def __init__(self, max_patients=MAX_PATIENTS):
+        self.max_patients = max_patients
+        self.patients = OrderedDict()    # patient id -> PatientIndex
+        self.lock = threading.Lock()
+
+    def _fetch(self, patient_id, since=None):
+        query = (
+            supabase
+            .table("memory_chunks")
+            .select("id,chunk_text,embedding,created_at")
+            .eq("patient_id", patient_id)
+        )
+        if since:
+            query = query.gte("created_at", since)
+        rows = query.order("created_at").execute().data or []
+        vectors = np.array([r["embedding"] for r in rows], dtype=np.float32) if rows else np.zeros((0, 0), np.float32)
+        return ([r["chunk_text"] for r in rows], vectors, [r["id"] for r in rows],
+                rows[-1]["created_at"] if rows else since)
+
+    def _refresh(self, patient_id, index):
+        """Append chunks another process inserted since we last looked."""
+        index.checked = time.monotonic()
+        texts, vectors, ids, newest = self._fetch(patient_id, since=index.newest)
+        if texts:
+            index.append(texts, vectors, ids, newest)
+
+    def get(self, patient_id):
+        with self.lock:
+            index = self.patients.get(patient_id)
+            if index is not None:
+                self.patients.move_to_end(patient_id)
+        if index is not None:
+            if time.monotonic() - index.checked > MEMORY_REFRESH_S:
+                self._refresh(patient_id, index)
+            return index
+        index = PatientIndex(*self._fetch(patient_id))
+        with self.lock:
+            index = self.patients.setdefault(patient_id, index)
+            while len(self.patients) > self.max_patients:
+                self.patients.popitem(last=False)
+        return index
+
+    def add(self, patient_id, conv_id, texts, vectors):
+        rows = supabase.table("memory_chunks").insert([
+            {"patient_id": patient_id, "conversation_id": conv_id, "chunk_text": t, "embedding": v.tolist()}
+            for t, v in zip(texts, vectors)
+        ]).execute().data or []
+        with self.lock:
+            index = self.patients.get(patient_id)
+        # only update patients already in memory; others load fresh on first recall
+        if index is not None:
+            index.append(texts, vectors, [r["id"] for r in rows],
+                         max((r["created_at"] for r in rows), default=None))
+
+
+memory_index = MemoryIndex()
+
+
+def index_conversation(conv_id):
+    """Summarize an ended session into moments and append them to the patient's index."""
+    conv = supabase.table("conversations").select("patient_id").eq("id", conv_id).single().execute().data or {}
+    patient_id = conv.get("patient_id")
+    history = (
+        supabase
+        .table("messages")
+        .select("sender_role,transcription,assistant_text")
+        .eq("conversation_id", conv_id)
+        .eq("invalidated", False)
+        .order("created_at")
+        .execute()
+        .data
+        or []
+    )
+    if not patient_id or sum(1 for m in history if m["sender_role"] == "user") < 2:
+        return 0
+
+    msgs = [
+        {"role": "user", "content": m["transcription"] or ""} if m["sender_role"] == "user"
+        else {"role": "assistant", "content": m["assistant_text"] or ""}
+        for m in history
+    ]
+    prompt = [{"role": "system", "content": MOMENTS_PROMPT.format(n=MAX_MOMENTS)}] + msgs
+    resp = limiter.call(
+        "openai", "gpt-3.5-turbo", BACKGROUND, openai_client.chat.completions.create,
+        tokens=estimate_tokens(prompt, 300),
+        model="gpt-3.5-turbo",
+        messages=prompt,
+        temperature=0.3,
+        max_tokens=300,
+    )
+    usage.record_openai(resp, "gpt-3.5-turbo", "memory_index")
+    lines = (resp.choices[0].message.content or "").splitlines()
+    moments = [l.strip(" -•\t") for l in lines if l.strip(" -•\t")][:MAX_MOMENTS]
+    if not moments:
+        return 0
+
+    memory_index.add(patient_id, conv_id, moments, embed(moments))
+    print(f"🧠 Indexed {len(moments)} moments for conv {conv_id}")
+    return len(moments)
+
+
+def recall(patient_id, text, budget=MEMORY_TOKEN_BUDGET):
+    """Most relevant past moments for `text`, best first, within `budget` tokens."""
+    if not patient_id or not text:
+        return []
+    index = memory_index.get(patient_id)
+    if index.size == 0:
+        return []   # nothing stored: skip the embedding call entirely
+    hits = index.search(embed([text], priority=CHAT, purpose="memory_recall"))[0]
+    picked, used = [], 0
+    for score, moment in hits:
+        cost = len(moment) // 4 + 1
+        if score < MEMORY_MIN_SCORE or used + cost > budget:
+            continue
+        picked.append(moment)
+        used += cost
+    return picked
@@ -0,0 +1,209 @@
+# ratelimit.py
+"""
+Token-bucket rate limiting with priority classes for OpenAI and ElevenLabs.
+
+Every upstream call goes through `limiter.call(...)`, which waits for both a
+request (RPM) and a token (TPM) budget for that provider/model, then retries
+429s and 5xx responses with backoff, honouring Retry-After.
+
+Lower-priority work yields when the budget is tight: each class may only
+spend down to its reserve, so the last slice of every bucket is kept for
+live voice and chat turns. Waiters on a bucket are also served in priority
+order: while a higher class is waiting, lower classes don't take budget.
+Waiters sleep until their bucket should have refilled and are woken early
+when a higher-priority waiter leaves, a Retry-After block expires, or a
+failed attempt's tokens are refunded.
+
+Limits are per process. Each service (worker, tts_stream_api) should be
+given its share of the account limits through RATE_LIMITS, e.g.
+RATE_LIMITS='{"openai:gpt-4-turbo": [400, 240000], "elevenlabs:*": [60, null]}'
+"""
+import json
+import os
+import random
+import threading
+import time
+
+from clients import load_env
+
+# ─── PRIORITY CLASSES ───────────────────────────────────────────────────────
+VOICE         = 0   # live voice turn
+CHAT          = 1   # live chat turn
+TRANSCRIPTION = 2
+BACKGROUND    = 3   # summaries, warmups
+
+# fraction of each bucket a class must leave untouched
+RESERVE = {VOICE: 0.0, CHAT: 0.05, TRANSCRIPTION: 0.15, BACKGROUND: 0.40}
+
+# (requests per minute, tokens per minute); None = unlimited
+DEFAULT_LIMITS = {
+    "openai:gpt-4-turbo":   (500, 300_000),
+    "openai:gpt-3.5-turbo": (3_500, 160_000),
+    "openai:whisper-1":     (50, None),
+    "openai:*":             (500, 150_000),
+    "elevenlabs:*":         (100, None),
+}
+
+MAX_RETRIES     = 4
+BACKOFF_BASE_S  = 0.5
+BACKOFF_MAX_S   = 30
+RETRYABLE       = {429, 500, 502, 503, 504}
+
+
+def estimate_tokens(messages=None, max_tokens=0):
+    """Cheap prompt+completion estimate (~4 chars per token), good enough for TPM budgeting."""
+    chars = sum(len(m.get("content") or "") for m in messages or [])
+    return chars // 4 + (max_tokens or 0)
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def can_take(self, amount, reserve):
+        # an oversized request may always run against a full bucket
+        return self.level - amount >= self.capacity * reserve or self.level >= self.capacity
+
+    def wait_time(self, amount, reserve):
+        target = min(self.capacity, amount + self.capacity * reserve)
+        return max(0.0, (target - self.level) / self.rate)
+
+
+class RateLimiter:
+    def __init__(self, limits=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.buckets = {}     # key -> (rpm bucket, tpm bucket or None)
+        self.blocked_until = {}
+        self.waiting = {}     # key -> {priority: number of waiting callers}
+        self.cond = threading.Condition()
+        self.stats = {"calls": 0, "waits": 0, "wait_s": 0.0, "retries": 0, "throttled": 0}
+
+    def _key(self, provider, model):
+        exact = f"{provider}:{model}"
+        return exact if exact in self.limits else f"{provider}:*"
+
+    def _buckets(self, key):
+        if key not in self.buckets:
+            rpm, tpm = self.limits.get(key, (None, None))
+            self.buckets[key] = (
+                TokenBucket(rpm) if rpm else None,
+                TokenBucket(tpm) if tpm else None,
+            )
+        return self.buckets[key]
+
+    def acquire(self, provider, model, tokens=0, priority=CHAT):
+        key = self._key(provider, model)
+        reserve = RESERVE.get(priority, 0.0)
+        started = time.monotonic()
+        with self.cond:
+            waiting = self.waiting.setdefault(key, {})
+            waiting[priority] = waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self.blocked_until.get(key, 0) - now
+                    if wait <= 0:
+                        pairs = [(b, n) for b, n in zip(self._buckets(key), (1, tokens)) if b]
+                        for b, _ in pairs:
+                            b.refill(now)
+                        ahead = any(p < priority and n for p, n in waiting.items())
+                        if not ahead and all(b.can_take(n, reserve) for b, n in pairs):
+                            for b, n in pairs:
+                                b.level -= n
+                            break
+                        wait = max((b.wait_time(n, reserve) for b, n in pairs), default=0.0)
+                    self.stats["waits"] += 1
+                    # woken early by notify_all; the cap bounds drift in refill estimates
+                    self.cond.wait(timeout=min(max(wait, 0.01), 1.0))
+            finally:
+                waiting[priority] -= 1
+                # lower classes queued behind this caller may go now
+                self.cond.notify_all()
+            waited = time.monotonic() - started
+            self.stats["calls"] += 1
+            self.stats["wait_s"] += waited
+
+    def refund(self, provider, model, tokens):
+        """Return `tokens` of TPM budget for an attempt the provider rejected."""
+        key = self._key(provider, model)
+        with self.cond:
+            tpm = self._buckets(key)[1]
+            if tpm and tokens:
+                tpm.level = min(tpm.capacity, tpm.level + tokens)
+                self.cond.notify_all()
+
+    def _wake(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def block(self, provider, model, seconds):
+        """Stop all callers of this provider/model for `seconds` (after a 429)."""
+        key = self._key(provider, model)
+        with self.cond:
+            self.blocked_until[key] = max(self.blocked_until.get(key, 0), time.monotonic() + seconds)
+            self.stats["throttled"] += 1
+        # wake waiters the moment the block clears
+        timer = threading.Timer(seconds, self._wake)
+        timer.daemon = True
+        timer.start()
+
+    def call(self, provider, model, priority, fn, /, *args, tokens=0, **kwargs):
+        """
+        Run fn(*args, **kwargs) under the limiter, retrying rate limits and 5xx.
+        The leading parameters are positional-only so `model=` etc. reach fn.
+        """
+        attempt = 0
+        while True:
+            self.acquire(provider, model, tokens, priority)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                status, retry_after = _error_info(e)
+                if status not in RETRYABLE or attempt >= MAX_RETRIES:
+                    raise
+                if status == 429:
+                    # rejected before any tokens were spent
+                    self.refund(provider, model, tokens)
+                delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt) * (0.5 + random.random() / 2)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                if status == 429:
+                    self.block(provider, model, delay)
+                attempt += 1
+                self.stats["retries"] += 1
+                print(f"⏳ {provider}:{model} returned {status}, retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+
+
+def _error_info(exc):
+    """(HTTP status, Retry-After seconds) from an openai or requests exception."""
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = None
+    raw = headers.get("retry-after") or headers.get("Retry-After")
+    if raw:
+        try:
+            retry_after = float(raw)
+        except ValueError:
+            pass
+    return status, retry_after
+
+
+def _limits_from_env():
+    load_env()
+    raw = os.getenv("RATE_LIMITS")
+    if not raw:
+        return {}
+    return {k: tuple(v) for k, v in json.loads(raw).items()}
+
+
+limiter = RateLimiter(_limits_from_env())
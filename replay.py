@@ -0,0 +1,443 @@
+# replay.py
+"""
+Replay a recorded realtime trace (see tracing.py) through the worker's real
+pipeline – route_event → EventIngestor → LaneScheduler → handle_ai_record,
+and handle_transcription_record for audio turns – against local fakes for
+Supabase, OpenAI and storage, then report throughput, queue wait and
+per-stage latency.
+
+  TRACE_PATH=trace.jsonl python worker.py         # record in production
+  python replay.py trace.jsonl --speed 10 --workers 16 --window 0.1
+
+Only client-originated events are replayed: user rows, minus the UPDATEs
+the worker itself caused (ai_started already set). Assistant rows in the
+trace are the old worker's output; the worker under test writes its own.
+Audio turns are transcribed and then handed to the ingestor, as the
+startup drain does. Traces keep only the shape of each transcription, so
+text is rebuilt from it: the recorded routing phrase padded to the recorded
+word count. Impersonal definition questions get a term from
+DEFINITION_TERMS, which means the answer cache hit rate is modelled rather
+than recorded. The fakes sleep to model latency (--db-ms, --ttft-ms,
+--token-ms, --whisper-ms, all scaled by --latency-scale), so the shared
+rate limiter, admission control and caches behave as they would live.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+os.environ.pop("TRACE_PATH", None)    # never record the replay itself
+
+import clients
+
+CRISIS_TEXT = "i want to end my life"
+DEFINITION_TERMS = ("anxiety", "depression", "mindfulness", "burnout", "grounding", "panic attacks")
+
+
+# ─── FAKE SUPABASE ───────────────────────────────────────────────────────────
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.orders = []
+        self.max_rows = None
+        self.one = False
+
+    def select(self, *_columns, **_kw):
+        self.op = "select"
+        return self
+
+    def insert(self, rows, **_kw):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def update(self, fields, **_kw):
+        self.op, self.payload = "update", fields
+        return self
+
+    def upsert(self, rows, on_conflict=None, **_kw):
+        self.op, self.payload, self.on_conflict = "upsert", rows, on_conflict
+        return self
+
+    def delete(self, **_kw):
+        self.op = "delete"
+        return self
+
+    def _where(self, column, test):
+        self.filters.append(lambda row: test(row.get(column)))
+        return self
+
+    def eq(self, column, value):
+        return self._where(column, lambda v: v == value)
+
+    def neq(self, column, value):
+        return self._where(column, lambda v: v != value)
+
+    def gt(self, column, value):
+        return self._where(column, lambda v: v is not None and v > value)
+
+    def gte(self, column, value):
+        return self._where(column, lambda v: v is not None and v >= value)
+
+    def lt(self, column, value):
+        return self._where(column, lambda v: v is not None and v < value)
+
+    def lte(self, column, value):
+        return self._where(column, lambda v: v is not None and v <= value)
+
+    def match(self, conds):
+        for column, value in conds.items():
+            self.eq(column, value)
+        return self
+
+    def order(self, column, desc=False, **_kw):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n, **_kw):
+        self.max_rows = n
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def execute(self):
+        self.db.pause()
+        return SimpleNamespace(data=self.db.run(self))
+
+
+class FakeStorageBucket:
+    def create_signed_url(self, path, _expires_in):
+        return {"signedURL": f"fake://{path}"}
+
+
+class FakeSupabase:
+    def __init__(self, latency_s=0.0):
+        self.latency_s = latency_s
+        self.lock = threading.Lock()
+        self.tables = {}    # name -> list of rows
+        self.queries = 0
+        self.storage = SimpleNamespace(from_=lambda _bucket: FakeStorageBucket())
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def pause(self):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def seed(self, table, row):
+        with self.lock:
+            rows = self.tables.setdefault(table, [])
+            for existing in rows:
+                if existing.get("id") == row.get("id"):
+                    existing.update(row)
+                    return existing
+            rows.append(dict(row))
+            return rows[-1]
+
+    def get(self, table, row_id):
+        with self.lock:
+            return next((dict(r) for r in self.tables.get(table, []) if r.get("id") == row_id), None)
+
+    def run(self, q):
+        now = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            self.queries += 1
+            rows = self.tables.setdefault(q.table, [])
+            matched = [r for r in rows if all(f(r) for f in q.filters)]
+
+            if q.op == "insert" or q.op == "upsert":
+                out = []
+                key = q.on_conflict or "id"
+                for new in q.payload if isinstance(q.payload, list) else [q.payload]:
+                    existing = next((r for r in rows if key in new and r.get(key) == new[key]), None)
+                    if existing is not None and q.op == "upsert":
+                        existing.update(new)
+                        out.append(dict(existing))
+                        continue
+                    row = {"id": str(uuid.uuid4()), "created_at": now, "updated_at": now,
+                           "invalidated": False, **new}
+                    rows.append(row)
+                    out.append(dict(row))
+                return out
+            if q.op == "update":
+                for r in matched:
+                    r.update(q.payload, updated_at=now)
+                return [dict(r) for r in matched]
+            if q.op == "delete":
+                for r in matched:
+                    rows.remove(r)
+                return [dict(r) for r in matched]
+
+            for column, desc in reversed(q.orders):
+                matched.sort(key=lambda r: (r.get(column) is None, r.get(column) or ""), reverse=desc)
+            if q.max_rows is not None:
+                matched = matched[:q.max_rows]
+            result = [dict(r) for r in matched]
+        if q.one:
+            return result[0] if result else None
+        return result
+
+
+# ─── FAKE OPENAI / HTTP ──────────────────────────────────────────────────────
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        for delay, chunk in self.chunks:
+            if self.closed:
+                return
+            time.sleep(delay)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeOpenAI:
+    def __init__(self, ttft_s, token_s, whisper_s, embed_s, transcripts, seed=1):
+        self.ttft_s = ttft_s
+        self.token_s = token_s
+        self.whisper_s = whisper_s
+        self.embed_s = embed_s
+        self.transcripts = transcripts     # audio bytes -> text
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._transcribe))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _reply_tokens(self, max_tokens):
+        with self.rng_lock:
+            return max(4, int((max_tokens or 150) * self.rng.uniform(0.3, 0.9)))
+
+    def _chat(self, model, messages, max_tokens=None, stream=False, stream_options=None, **_kw):
+        n = self._reply_tokens(max_tokens)
+        words = ["word"] * (n - 1) + ["end."]
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=n)
+        if not stream:
+            time.sleep(self.ttft_s + n * self.token_s)
+            message = SimpleNamespace(content=" ".join(words), function_call=None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+        chunks = []
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            choice = SimpleNamespace(delta=SimpleNamespace(content=word + ("" if last else " ")),
+                                     finish_reason="stop" if last else None)
+            chunks.append((self.ttft_s if i == 0 else self.token_s, SimpleNamespace(choices=[choice], usage=None)))
+        if (stream_options or {}).get("include_usage"):
+            chunks.append((0.0, SimpleNamespace(choices=[], usage=usage)))
+        return FakeStream(chunks)
+
+    def _transcribe(self, model, file, **_kw):
+        time.sleep(self.whisper_s)
+        audio = file.read()
+        text = self.transcripts.get(audio) or "i feel okay today"
+        return SimpleNamespace(text=text, duration=len(text.split()) * 0.4)
+
+    def _embed(self, model, input, **_kw):
+        time.sleep(self.embed_s)
+        data = [SimpleNamespace(embedding=[float(b) for b in hashlib.sha256(t.encode()).digest()[:16]]) for t in input]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(prompt_tokens=sum(len(t) for t in input) // 4,
+                                                                completion_tokens=0))
+
+
+class FakeHTTP:
+    def get(self, url, **_kw):
+        # audio bytes stand in for the upload: the traced (hashed) path
+        return SimpleNamespace(content=url[len("fake://"):].encode(), status_code=200)
+
+
+# ─── REPLAY ──────────────────────────────────────────────────────────────────
+def load_trace(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replayable(event):
+    msg = event["msg"]
+    if msg.get("sender_role") != "user":
+        return False
+    return event["event"] != "UPDATE" or not msg.get("ai_started")
+
+
+def text_from_shape(shape, rng):
+    """Stand-in text that routes like the recorded transcription (see tracing.py)."""
+    if not isinstance(shape, dict):
+        return shape
+    route = shape.get("route")
+    extra = max(shape.get("words", 0) - len(route.split() if route else ()), 0)
+    if route in ("what is", "define") and not shape.get("personal") and 1 <= extra <= 5:
+        return f"{route} {rng.choice(DEFINITION_TERMS)}"
+    filler = ["me" if shape.get("personal") else "okay"] * extra
+    return " ".join(([route] if route else []) + filler)
+
+
+def transcripts_from(events, rng):
+    """Final transcription of each audio upload, for the fake Whisper."""
+    out = {}
+    for e in events:
+        msg = e["msg"]
+        if msg.get("audio_path") and msg.get("transcription"):
+            text = CRISIS_TEXT if msg.get("crisis") else text_from_shape(msg["transcription"], rng)
+            out[msg["audio_path"].encode()] = text
+    return out
+
+
+def install_fakes(args, events):
+    scale = args.latency_scale
+    db = FakeSupabase(args.db_ms / 1000 * scale)
+    llm = FakeOpenAI(args.ttft_ms / 1000 * scale, args.token_ms / 1000 * scale,
+                     args.whisper_ms / 1000 * scale, args.embed_ms / 1000 * scale,
+                     transcripts_from(events, random.Random(args.seed)), seed=args.seed)
+    # the shared clients are lazy proxies; giving them an object skips the real factory
+    clients.supabase._obj = db
+    clients.supabase_admin._obj = db
+    clients.openai_client._obj = llm
+    clients.storage_sess._obj = FakeHTTP()
+
+    voice_rng = random.Random(args.seed)
+    for conv_id in sorted({e["msg"]["conversation_id"] for e in events if e["msg"].get("conversation_id")}):
+        db.seed("conversations", {
+            "id": conv_id, "voice_enabled": voice_rng.random() < args.voice_share,
+            "therapist_id": None, "patient_id": None, "memory_summary": "",
+            "needs_resummarization": False, "ended": False,
+        })
+    return db
+
+
+async def replay(args, events, db):
+    import worker
+    from tracing import stage_timings
+
+    loop = asyncio.get_running_loop()
+    lanes = worker.LaneScheduler(loop, worker.handle_ai_record, max_workers=args.workers)
+    ingestor = worker.EventIngestor(loop, lanes.submit, window=args.window)
+    transcribers = ThreadPoolExecutor(max_workers=args.transcribers, thread_name_prefix="replay-stt")
+    worker.history_cache.set_enabled(True)
+    worker.answer_cache.set_enabled(True)
+    stage_timings.reset()
+    pending_stt = set()
+    applied = 0
+    text_rng = random.Random(args.seed)
+
+    def transcribed(msg_id):
+        row = db.get("messages", msg_id)
+        if row and row.get("transcription_status") == "done" and row.get("ai_status") == "pending":
+            worker.route_event("BACKFILL", row, ingestor)
+
+    def apply(event):
+        nonlocal applied
+        applied += 1
+        msg = dict(event["msg"])
+        msg.setdefault("invalidated", False)
+        msg.setdefault("ai_started", False)
+        if msg.pop("crisis", False):
+            msg["transcription"] = CRISIS_TEXT
+        elif msg.get("transcription"):
+            msg["transcription"] = text_from_shape(msg["transcription"], text_rng)
+        db.seed("messages", msg)
+        if event["event"] == "INSERT" and msg.get("transcription_status") == "pending" and msg.get("audio_path"):
+            fut = loop.run_in_executor(transcribers, worker.handle_transcription_record, msg)
+            pending_stt.add(fut)
+            fut.add_done_callback(lambda f, mid=msg["id"]: (pending_stt.discard(f), transcribed(mid)))
+            return
+        worker.route_event(event["event"], msg, ingestor)
+
+    started = loop.time()
+    t0 = events[0]["t"] if events else 0.0
+    for event in events:
+        delay = (event["t"] - t0) / args.speed if args.speed > 0 else 0.0
+        loop.call_at(started + delay, apply, event)
+
+    while (applied < len(events) or pending_stt or ingestor.pending
+           or ingestor.in_flight or lanes.running or lanes.lanes):
+        await asyncio.sleep(0.05)
+    elapsed = loop.time() - started
+    lanes.executor.shutdown(wait=False)
+    transcribers.shutdown(wait=False)
+
+    stages = stage_timings.summary()
+    turns = stages.get("turn", {}).get("count", 0)
+    return {
+        "events": len(events),
+        "trace_span_s": round(events[-1]["t"] - t0, 1) if events else 0.0,
+        "elapsed_s": round(elapsed, 2),
+        "turns": turns,
+        "transcriptions": stages.get("transcribe", {}).get("count", 0),
+        "throughput_turns_per_s": round(turns / elapsed, 2) if elapsed else None,
+        "stages": stages,
+        "ingestor": dict(ingestor.stats),
+        "ai_admission": worker.ai_admission.stats(),
+        "answer_cache": worker.answer_cache.stats(),
+        "history_cache": worker.history_cache.stats(),
+        "rate_limiter": dict(worker.limiter.stats),
+        "db_queries": db.queries,
+    }
+
+
+def print_report(report, args):
+    print(f"\nReplayed {report['events']} events ({report['trace_span_s']}s of trace) "
+          f"at {args.speed or 'max'}x with {args.workers} AI workers, window {args.window}s")
+    print(f"  {report['turns']} turns, {report['transcriptions']} transcriptions in {report['elapsed_s']}s "
+          f"→ {report['throughput_turns_per_s']} turns/s, {report['db_queries']} DB queries")
+    print(f"\n  {'stage':<12}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, s in sorted(report["stages"].items()):
+        print(f"  {stage:<12}{s['count']:>7}{s['p50_ms']:>10}{s['p90_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+    for key in ("ingestor", "ai_admission", "answer_cache", "history_cache", "rate_limiter"):
+        print(f"\n  {key}: {json.dumps(report[key])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression; 0 = as fast as possible")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AI_WORKERS", "8")))
+    parser.add_argument("--transcribers", type=int, default=4)
+    parser.add_argument("--window", type=float, default=0.25, help="ingestor coalesce window (s)")
+    parser.add_argument("--voice-share", type=float, default=0.0, help="fraction of conversations in voice mode")
+    parser.add_argument("--db-ms", type=float, default=8)
+    parser.add_argument("--ttft-ms", type=float, default=400)
+    parser.add_argument("--token-ms", type=float, default=12)
+    parser.add_argument("--whisper-ms", type=float, default=900)
+    parser.add_argument("--embed-ms", type=float, default=60)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every fake latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    events = [e for e in load_trace(args.trace) if replayable(e)]
+    if not events:
+        sys.exit(f"no replayable user events in {args.trace}")
+    db = install_fakes(args, events)
+    # the worker's per-turn logging goes to stderr; stdout is just the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(replay(args, events, db))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -55,6 +55,8 @@ const SessionRoom = () => {
   const voiceTimeoutRef = useRef<number | null>(null);
   const [streamedMap, setStreamedMap] = useState<Record<string, boolean>>({});
   const snippetCountMap = useRef<Record<string, number>>({});
+  // server snippet plan per reply, requested when its first snippet starts
+  const snippetPlans = useRef<Record<string, Promise<void>>>({});
   const playedSnippetsRef = useRef<Set<string>>(new Set());
   const [snippetUrls, setSnippetUrls] = useState<Record<string, string>>({});
   const [editingId, setEditingId] = useState<string | null>(null);
@@ -116,6 +118,7 @@ const SessionRoom = () => {
     // for every new assistant message, figure out how many snippets it needs
     displayedMessages.forEach((msg) => {
       if (!msg.isUser && snippetCountMap.current[msg.id] == null) {
+        // local estimate until the server tells us how it chunked the reply
         const sentences = msg.content.split(/(?<=[.!?])\s+/);
         snippetCountMap.current[msg.id] = sentences.length;
 
@@ -340,6 +343,35 @@ const SessionRoom = () => {
     setCurrentlyPlayingPath(messageId);
     setIsPaused(false);
 
+    // ask the server how it chunked this reply, once, while snippet 0 plays
+    if (snippetIndex === 0 && !snippetPlans.current[messageId]) {
+      snippetPlans.current[messageId] = fetch(`${STREAM_BASE}/tts-plan/${messageId}`)
+        .then((res) => (res.ok ? res.json() : null))
+        .then((plan) => {
+          if (plan?.count != null) {
+            snippetCountMap.current[messageId] = plan.count;
+          }
+        })
+        .catch(() => {});
+    }
+
+    const finishMessage = () => {
+      setStreamedMap((prev) => ({ ...prev, [messageId]: true }));
+
+      // wait a bit for the browser’s audio stack to fully tear down
+      setTimeout(() => {
+        setIsMicLocked(false); // unlock mic
+        setIsPaused(false);
+        audioRef.current = null; // drop your ref
+        setCurrentlyPlayingPath(null); // now clear “playing” flag
+        handleRecognitionResumed(); // and finally let ASR resume
+        if (messageId === greetingIdRef.current) {
+          setVoiceActive(true); // now show the VoiceRecorder
+          setVoiceEnabled(true); // update your TherapistContext
+        }
+      }, 1);
+    };
+
     // 1) point at your streaming endpoint
     const url = `${STREAM_BASE}/tts-stream/${messageId}?snippet=${snippetIndex}`;
     const audio = new Audio();
@@ -379,29 +411,27 @@ const SessionRoom = () => {
 
     // 3) clean up on end / error
     audio.onended = () => {
-      const total = snippetCountMap.current[messageId] || 0;
-      if (snippetIndex + 1 < total) {
-        return handlePlayAudio(messageId, snippetIndex + 1);
-      }
-
-      // final snippet has finished — gate everything behind a delay
-      setStreamedMap((prev) => ({ ...prev, [messageId]: true }));
-
-      // wait a bit for the browser’s audio stack to fully tear down
-      setTimeout(() => {
-        setIsMicLocked(false); // unlock mic
-        setIsPaused(false);
-        audioRef.current = null; // drop your ref
-        setCurrentlyPlayingPath(null); // now clear “playing” flag
-        handleRecognitionResumed(); // and finally let ASR resume
-        if (messageId === greetingIdRef.current) {
-          setVoiceActive(true); // now show the VoiceRecorder
-          setVoiceEnabled(true); // update your TherapistContext
+      // the local count is only an estimate; wait for the server's plan first
+      const planned = snippetPlans.current[messageId] ?? Promise.resolve();
+      planned.then(() => {
+        const total = snippetCountMap.current[messageId] || 0;
+        if (snippetIndex + 1 < total) {
+          handlePlayAudio(messageId, snippetIndex + 1);
+          return;
         }
-      }, 1);
+        // final snippet has finished — gate everything behind a delay
+        finishMessage();
+      });
     };
 
     audio.onerror = (e) => {
+      if (snippetIndex > 0) {
+        // past the server's last snippet (e.g. the plan never arrived and the
+        // estimate ran long): the reply is over, voice itself is fine
+        console.warn(`🔊 snippet ${snippetIndex} of ${messageId} unavailable, ending reply`, e);
+        finishMessage();
+        return;
+      }
       console.error("🔊 stream playback error", e);
       if (voiceTimeoutRef.current) {
         clearTimeout(voiceTimeoutRef.current);
@@ -1,7 +1,11 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
+from datetime import date, timedelta
+import hmac
 import os
+from clients import supabase
 from worker import summarize_and_store, close_inactive_conversations
 
 app = FastAPI()
@@ -37,6 +41,38 @@ async def cleanup_inactive():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+USAGE_GROUPS = ("patient", "therapist", "day")
+# operators call /usage with "Authorization: Bearer $USAGE_API_TOKEN"; unset = endpoint off
+USAGE_API_TOKEN = os.getenv("USAGE_API_TOKEN")
+
+def require_usage_token(request: Request):
+    if not USAGE_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Usage reporting is disabled (USAGE_API_TOKEN not set)")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), USAGE_API_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid usage token")
+
+@app.get("/usage")
+async def usage_report(request: Request, group_by: str = "day", since: Optional[date] = None):
+    """
+    Token, audio and character totals with cost, grouped by patient,
+    therapist persona or day and broken down by purpose. The grouping runs
+    in SQL (usage_report over the usage_daily view), so it isn't subject to
+    PostgREST's row limit. Defaults to the last 30 days. Reads with the
+    service role, so it requires the operator token.
+    """
+    require_usage_token(request)
+    if group_by not in USAGE_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {sorted(USAGE_GROUPS)}")
+    since = since or date.today() - timedelta(days=30)
+    return (
+        supabase
+        .rpc("usage_report", {"p_group_by": group_by, "p_since": since.isoformat()})
+        .execute()
+        .data
+        or []
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("summarizer_api:app", host="0.0.0.0", port=8001, reload=True)
\ No newline at end of file
@@ -0,0 +1,54 @@
+-- Scoring rules for assessments, read once by the API's scoring engine
+
+-- Per-question scoring metadata
+ALTER TABLE assessment_questions
+ADD COLUMN subscale text,
+ADD COLUMN reverse_scored boolean NOT NULL DEFAULT false;
+
+-- Severity bands: a score >= min_score (and below the next band) gets label.
+-- subscale is null for bands on the total score.
+CREATE TABLE assessment_score_bands (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  assessment_id uuid NOT NULL REFERENCES assessments(id) ON DELETE CASCADE,
+  subscale text,
+  min_score integer NOT NULL,
+  label text NOT NULL,
+  created_at timestamptz DEFAULT now()
+);
+
+CREATE INDEX assessment_score_bands_assessment_id_idx
+ON assessment_score_bands (assessment_id);
+
+-- Seed the instruments we already interpret
+INSERT INTO assessment_score_bands (assessment_id, min_score, label)
+SELECT a.id, b.min_score, b.label
+FROM assessments a
+JOIN (VALUES
+  (0, 'Minimal Depression'),
+  (5, 'Mild Depression'),
+  (10, 'Moderate Depression'),
+  (15, 'Moderately Severe Depression'),
+  (20, 'Severe Depression')
+) AS b(min_score, label) ON true
+WHERE a.name ILIKE 'PHQ%';
+
+INSERT INTO assessment_score_bands (assessment_id, min_score, label)
+SELECT a.id, b.min_score, b.label
+FROM assessments a
+JOIN (VALUES
+  (0, 'Minimal Anxiety'),
+  (5, 'Mild Anxiety'),
+  (10, 'Moderate Anxiety'),
+  (15, 'Severe Anxiety')
+) AS b(min_score, label) ON true
+WHERE a.name ILIKE 'GAD%';
+
+INSERT INTO assessment_score_bands (assessment_id, min_score, label)
+SELECT a.id, b.min_score, b.label
+FROM assessments a
+JOIN (VALUES
+  (0, 'Low distress'),
+  (8, 'Moderate distress'),
+  (13, 'Serious psychological distress')
+) AS b(min_score, label) ON true
+WHERE a.name ILIKE '%Kessler%' OR a.name ILIKE 'K6%';
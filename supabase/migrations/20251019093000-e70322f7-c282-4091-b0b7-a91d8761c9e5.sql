@@ -0,0 +1,42 @@
+-- Per-patient, per-instrument score aggregate maintained on each submission
+
+CREATE TABLE assessment_trends (
+  user_id uuid NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+  assessment_id uuid NOT NULL REFERENCES assessments(id) ON DELETE CASCADE,
+  assessment_name text NOT NULL,
+  latest_score integer NOT NULL,
+  delta integer,
+  rolling_avg numeric(6, 2) NOT NULL,
+  result_text text,
+  submissions integer NOT NULL DEFAULT 1,
+  -- newest last: [{"score": 12, "submitted_at": "..."}]
+  recent jsonb NOT NULL DEFAULT '[]'::jsonb,
+  updated_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, assessment_id)
+);
+
+-- Backfill from existing results (last 5 submissions per instrument)
+INSERT INTO assessment_trends (
+  user_id, assessment_id, assessment_name, latest_score, delta,
+  rolling_avg, result_text, submissions, recent, updated_at
+)
+SELECT
+  r.user_id,
+  r.assessment_id,
+  a.name,
+  (array_agg(r.score ORDER BY r.submitted_at DESC))[1],
+  (array_agg(r.score ORDER BY r.submitted_at DESC))[1]
+    - (array_agg(r.score ORDER BY r.submitted_at DESC))[2],
+  avg(r.score) FILTER (WHERE r.rn <= 5),
+  (array_agg(r.result_text ORDER BY r.submitted_at DESC))[1],
+  count(*),
+  jsonb_agg(jsonb_build_object('score', r.score, 'submitted_at', r.submitted_at)
+            ORDER BY r.submitted_at) FILTER (WHERE r.rn <= 5),
+  max(r.submitted_at)
+FROM (
+  SELECT *, row_number() OVER (PARTITION BY user_id, assessment_id ORDER BY submitted_at DESC) AS rn
+  FROM assessment_results
+) r
+JOIN assessments a ON a.id = r.assessment_id
+JOIN patients p ON p.id = r.user_id
+GROUP BY r.user_id, r.assessment_id, a.name;
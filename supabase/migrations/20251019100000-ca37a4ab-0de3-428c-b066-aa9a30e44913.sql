@@ -0,0 +1,12 @@
+-- Whisper results keyed by a SHA-256 of the uploaded audio bytes, so
+-- retried / re-uploaded audio is not transcribed twice
+
+CREATE TABLE transcription_cache (
+  audio_sha256 text PRIMARY KEY,
+  transcription text NOT NULL,
+  duration_s real,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX transcription_cache_created_at_idx
+ON transcription_cache (created_at);
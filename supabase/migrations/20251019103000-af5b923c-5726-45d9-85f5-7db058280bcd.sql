@@ -0,0 +1,14 @@
+-- Summarized moments from ended sessions with their embeddings, loaded per
+-- patient into the worker's in-memory vector index
+
+CREATE TABLE memory_chunks (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  patient_id uuid NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+  conversation_id uuid REFERENCES conversations(id) ON DELETE CASCADE,
+  chunk_text text NOT NULL,
+  embedding real[] NOT NULL,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX memory_chunks_patient_id_idx
+ON memory_chunks (patient_id, created_at);
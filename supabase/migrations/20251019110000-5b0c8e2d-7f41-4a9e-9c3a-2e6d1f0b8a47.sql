@@ -0,0 +1,43 @@
+-- Append-only record of every OpenAI / ElevenLabs call, written in batches
+-- by usage.py. No foreign keys: rows outlive deleted messages and inserts
+-- stay cheap. message_id is the user message for LLM/Whisper calls and the
+-- assistant message for TTS.
+
+CREATE TABLE llm_usage (
+  id bigserial PRIMARY KEY,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  provider text NOT NULL,
+  model text NOT NULL,
+  purpose text NOT NULL,
+  message_id uuid,
+  conversation_id uuid,
+  prompt_tokens integer NOT NULL DEFAULT 0,
+  completion_tokens integer NOT NULL DEFAULT 0,
+  audio_seconds real,
+  characters integer,
+  cost_usd numeric(12, 6) NOT NULL DEFAULT 0
+);
+
+CREATE INDEX llm_usage_created_at_idx ON llm_usage USING brin (created_at);
+CREATE INDEX llm_usage_conversation_id_idx ON llm_usage (conversation_id);
+
+-- Daily totals per patient, therapist persona, purpose and model. TTS rows
+-- carry only a message id, so their conversation comes from messages.
+CREATE VIEW usage_daily AS
+SELECT
+  date_trunc('day', u.created_at)::date AS day,
+  c.patient_id,
+  c.therapist_id,
+  u.provider,
+  u.model,
+  u.purpose,
+  count(*) AS calls,
+  sum(u.prompt_tokens) AS prompt_tokens,
+  sum(u.completion_tokens) AS completion_tokens,
+  sum(coalesce(u.audio_seconds, 0)) AS audio_seconds,
+  sum(coalesce(u.characters, 0)) AS characters,
+  sum(u.cost_usd) AS cost_usd
+FROM llm_usage u
+LEFT JOIN messages m ON u.conversation_id IS NULL AND m.id = u.message_id
+LEFT JOIN conversations c ON c.id = coalesce(u.conversation_id, m.conversation_id)
+GROUP BY 1, 2, 3, 4, 5, 6;
@@ -0,0 +1,126 @@
+-- assessment_trends holds per-patient PHQ/GAD scores: lock it down, and move
+-- trend maintenance into SQL so concurrent submissions can't lose updates.
+
+ALTER TABLE assessment_trends ENABLE ROW LEVEL SECURITY;
+
+-- patients may read their own trends; all writes go through the service role
+CREATE POLICY "Patients can read their own assessment trends"
+ON assessment_trends FOR SELECT
+TO authenticated
+USING (auth.uid() = user_id);
+
+-- Fold one new submission into the trend row, under a row lock
+CREATE OR REPLACE FUNCTION record_assessment_trend(
+  p_user_id uuid,
+  p_assessment_id uuid,
+  p_assessment_name text,
+  p_score integer,
+  p_result_text text,
+  p_submitted_at timestamptz,
+  p_window integer DEFAULT 5
+)
+RETURNS assessment_trends
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  prev assessment_trends;
+  v_recent jsonb;
+  result assessment_trends;
+BEGIN
+  INSERT INTO assessment_trends (
+    user_id, assessment_id, assessment_name, latest_score, delta,
+    rolling_avg, result_text, submissions, recent, updated_at
+  )
+  VALUES (
+    p_user_id, p_assessment_id, p_assessment_name, p_score, NULL,
+    p_score, p_result_text, 1,
+    jsonb_build_array(jsonb_build_object('score', p_score, 'submitted_at', p_submitted_at)),
+    p_submitted_at
+  )
+  ON CONFLICT (user_id, assessment_id) DO NOTHING
+  RETURNING * INTO result;
+  IF FOUND THEN
+    RETURN result;
+  END IF;
+
+  SELECT * INTO prev FROM assessment_trends
+  WHERE user_id = p_user_id AND assessment_id = p_assessment_id
+  FOR UPDATE;
+
+  SELECT coalesce(jsonb_agg(e ORDER BY ord), '[]'::jsonb) INTO v_recent
+  FROM (
+    SELECT e, ord
+    FROM jsonb_array_elements(
+      prev.recent || jsonb_build_array(jsonb_build_object('score', p_score, 'submitted_at', p_submitted_at))
+    ) WITH ORDINALITY AS t(e, ord)
+    ORDER BY ord DESC
+    LIMIT p_window
+  ) s;
+
+  UPDATE assessment_trends SET
+    assessment_name = p_assessment_name,
+    latest_score = p_score,
+    delta = p_score - prev.latest_score,
+    rolling_avg = (SELECT round(avg((e->>'score')::numeric), 2) FROM jsonb_array_elements(v_recent) e),
+    result_text = p_result_text,
+    submissions = prev.submissions + 1,
+    recent = v_recent,
+    updated_at = p_submitted_at
+  WHERE user_id = p_user_id AND assessment_id = p_assessment_id
+  RETURNING * INTO result;
+  RETURN result;
+END;
+$$;
+
+-- Recompute trend rows from assessment_results (after a re-score)
+CREATE OR REPLACE FUNCTION rebuild_assessment_trends(
+  p_assessment_id uuid,
+  p_user_ids uuid[],
+  p_window integer DEFAULT 5
+)
+RETURNS integer
+LANGUAGE sql
+AS $$
+  WITH rebuilt AS (
+    INSERT INTO assessment_trends (
+      user_id, assessment_id, assessment_name, latest_score, delta,
+      rolling_avg, result_text, submissions, recent, updated_at
+    )
+    SELECT
+      r.user_id,
+      r.assessment_id,
+      a.name,
+      (array_agg(r.score ORDER BY r.submitted_at DESC))[1],
+      (array_agg(r.score ORDER BY r.submitted_at DESC))[1]
+        - (array_agg(r.score ORDER BY r.submitted_at DESC))[2],
+      round(avg(r.score) FILTER (WHERE r.rn <= p_window), 2),
+      (array_agg(r.result_text ORDER BY r.submitted_at DESC))[1],
+      count(*),
+      jsonb_agg(jsonb_build_object('score', r.score, 'submitted_at', r.submitted_at)
+                ORDER BY r.submitted_at) FILTER (WHERE r.rn <= p_window),
+      max(r.submitted_at)
+    FROM (
+      SELECT *, row_number() OVER (PARTITION BY user_id ORDER BY submitted_at DESC) AS rn
+      FROM assessment_results
+      WHERE assessment_id = p_assessment_id AND user_id = ANY (p_user_ids)
+    ) r
+    JOIN assessments a ON a.id = r.assessment_id
+    GROUP BY r.user_id, r.assessment_id, a.name
+    ON CONFLICT (user_id, assessment_id) DO UPDATE SET
+      assessment_name = EXCLUDED.assessment_name,
+      latest_score = EXCLUDED.latest_score,
+      delta = EXCLUDED.delta,
+      rolling_avg = EXCLUDED.rolling_avg,
+      result_text = EXCLUDED.result_text,
+      submissions = EXCLUDED.submissions,
+      recent = EXCLUDED.recent,
+      updated_at = EXCLUDED.updated_at
+    RETURNING 1
+  )
+  SELECT count(*)::integer FROM rebuilt;
+$$;
+
+REVOKE EXECUTE ON FUNCTION record_assessment_trend(uuid, uuid, text, integer, text, timestamptz, integer)
+  FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION rebuild_assessment_trends(uuid, uuid[], integer)
+  FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,4 @@
+-- transcription_cache holds patients' Whisper transcripts; only the worker
+-- (service role, which bypasses RLS) reads or writes it, so no policies.
+
+ALTER TABLE transcription_cache ENABLE ROW LEVEL SECURITY;
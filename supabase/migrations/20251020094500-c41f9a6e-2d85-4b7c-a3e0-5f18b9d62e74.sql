@@ -0,0 +1,4 @@
+-- memory_chunks holds summaries of patients' past sessions; only the worker
+-- and summarizer (service role, which bypasses RLS) touch it, so no policies.
+
+ALTER TABLE memory_chunks ENABLE ROW LEVEL SECURITY;
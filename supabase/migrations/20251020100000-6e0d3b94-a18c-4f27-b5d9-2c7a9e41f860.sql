@@ -0,0 +1,73 @@
+-- llm_usage and usage_daily expose per-patient activity: lock them down, and
+-- do the /usage grouping in SQL so results aren't cut off at PostgREST's row
+-- limit. Only the service role (which bypasses RLS) reads or writes these.
+
+ALTER TABLE llm_usage ENABLE ROW LEVEL SECURITY;
+
+-- evaluate the view with the caller's privileges, so llm_usage's RLS applies
+ALTER VIEW usage_daily SET (security_invoker = true);
+REVOKE ALL ON usage_daily FROM anon, authenticated;
+
+-- Totals since p_since grouped by 'patient', 'therapist' or 'day', each with
+-- a per-purpose breakdown; one jsonb array, most expensive group first
+CREATE OR REPLACE FUNCTION usage_report(p_group_by text, p_since date)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+  WITH per_purpose AS (
+    SELECT
+      CASE p_group_by
+        WHEN 'patient' THEN patient_id::text
+        WHEN 'therapist' THEN therapist_id::text
+        ELSE day::text
+      END AS key,
+      purpose,
+      sum(calls) AS calls,
+      sum(prompt_tokens) AS prompt_tokens,
+      sum(completion_tokens) AS completion_tokens,
+      sum(audio_seconds) AS audio_seconds,
+      sum(characters) AS characters,
+      sum(cost_usd) AS cost_usd
+    FROM usage_daily
+    WHERE day >= p_since
+    GROUP BY 1, 2
+  ),
+  per_group AS (
+    SELECT
+      key,
+      sum(calls) AS calls,
+      sum(prompt_tokens) AS prompt_tokens,
+      sum(completion_tokens) AS completion_tokens,
+      sum(audio_seconds) AS audio_seconds,
+      sum(characters) AS characters,
+      sum(cost_usd) AS cost_usd,
+      jsonb_object_agg(purpose, jsonb_build_object(
+        'calls', calls,
+        'prompt_tokens', prompt_tokens,
+        'completion_tokens', completion_tokens,
+        'audio_seconds', audio_seconds,
+        'characters', characters,
+        'cost_usd', cost_usd
+      )) AS by_purpose
+    FROM per_purpose
+    GROUP BY key
+  )
+  SELECT coalesce(jsonb_agg(
+    jsonb_build_object(
+      CASE p_group_by WHEN 'patient' THEN 'patient_id' WHEN 'therapist' THEN 'therapist_id' ELSE 'day' END, key,
+      'by_purpose', by_purpose,
+      'calls', calls,
+      'prompt_tokens', prompt_tokens,
+      'completion_tokens', completion_tokens,
+      'audio_seconds', audio_seconds,
+      'characters', characters,
+      'cost_usd', round(cost_usd, 4)
+    )
+    ORDER BY cost_usd DESC
+  ), '[]'::jsonb)
+  FROM per_group;
+$$;
+
+REVOKE EXECUTE ON FUNCTION usage_report(text, date)
+  FROM PUBLIC, anon, authenticated;
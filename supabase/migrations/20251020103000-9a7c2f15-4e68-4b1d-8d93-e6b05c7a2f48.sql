@@ -0,0 +1,18 @@
+-- Bump messages.updated_at on every update. The client edit paths set only
+-- edited_at, and the worker's backfill after a realtime outage (and its
+-- "newest row seen" watermark) is keyed on updated_at.
+
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.updated_at := now();
+  RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER messages_touch_updated_at
+BEFORE UPDATE ON messages
+FOR EACH ROW
+EXECUTE FUNCTION touch_updated_at();
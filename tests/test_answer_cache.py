@@ -0,0 +1,93 @@
+import pytest
+
+import worker
+from worker import AnswerCache, normalize_definition_query
+
+
+@pytest.mark.parametrize("text, term", [
+    ("what is anxiety", "anxiety"),
+    ("What is the Anxiety?", "anxiety"),
+    ("define mindfulness", "mindfulness"),
+    ("define panic attacks", "panic attack"),
+    ("What is CBT?", "cbt"),
+    ("what is phq-9", "phq-9"),
+])
+def test_glossary_questions_normalize_to_their_term(text, term):
+    assert normalize_definition_query(text) == term
+
+
+@pytest.mark.parametrize("text", [
+    "what is that?",
+    "what is it",
+    "define it",
+    "what is wrong",
+    "what is going on",
+    "what is this feeling",
+    "what is the point of living",
+    "what is my anxiety",
+    "what is wrong with me",
+    "tell me about anxiety",
+    "anxiety",
+])
+def test_contextual_personal_and_unlisted_questions_are_not_cacheable(text):
+    assert normalize_definition_query(text) is None
+
+
+def test_definition_payload_carries_only_the_persona_and_question(monkeypatch):
+    monkeypatch.setattr(worker, "persona_system_prompt", lambda therapist_id: f"persona {therapist_id}")
+    payload = worker.build_definition_payload("t1", "what is anxiety")
+    assert payload[0] == {"role": "system", "content": "persona t1"}
+    assert payload[1:-1] == worker.SKY_EXAMPLE_DIALOG
+    assert payload[-1] == {"role": "user", "content": "what is anxiety"}
+
+
+@pytest.fixture
+def cache():
+    c = AnswerCache(max_entries=2, ttl_s=60)
+    c.set_enabled(True)
+    return c
+
+
+def test_put_then_get(cache):
+    cache.put(("t1", "anxiety"), "Anxiety is...", "q1", "r1")
+    assert cache.get(("t1", "anxiety")) == "Anxiety is..."
+    assert cache.get(("t2", "anxiety")) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_disabled_cache_neither_stores_nor_serves(cache):
+    cache.set_enabled(False)
+    cache.put(("t1", "anxiety"), "Anxiety is...", "q1")
+    cache.set_enabled(True)
+    assert cache.get(("t1", "anxiety")) is None
+
+
+def test_blank_replies_are_not_cached(cache):
+    cache.put(("t1", "anxiety"), "   ", "q1")
+    assert cache.get(("t1", "anxiety")) is None
+
+
+@pytest.mark.parametrize("source", ["q1", "r1"])
+def test_invalidating_either_source_message_drops_the_entry(cache, source):
+    cache.put(("t1", "anxiety"), "Anxiety is...", "q1", "r1")
+    cache.invalidate_message(source)
+    assert cache.get(("t1", "anxiety")) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put(("t1", "anxiety"), "a", "q1")
+    cache.put(("t1", "grief"), "g", "q2")
+    cache.get(("t1", "anxiety"))
+    cache.put(("t1", "burnout"), "b", "q3")
+    assert cache.get(("t1", "grief")) is None
+    assert cache.get(("t1", "anxiety")) == "a"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_the_ttl(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(worker.time, "monotonic", lambda: now[0])
+    cache.put(("t1", "anxiety"), "a", "q1")
+    now[0] += 61
+    assert cache.get(("t1", "anxiety")) is None
@@ -0,0 +1,100 @@
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def assessment():
+    # assessment.py is deployed inside the API package next to db.py; load it
+    # under a throwaway package whose db module has no client (rules are set
+    # directly below, so the database is never queried)
+    pkg = types.ModuleType("assessment_pkg")
+    pkg.__path__ = []
+    db = types.ModuleType("assessment_pkg.db")
+    db.supabase_admin = None
+    sys.modules.update({"assessment_pkg": pkg, "assessment_pkg.db": db})
+    spec = importlib.util.spec_from_file_location("assessment_pkg.assessment", os.path.join(ROOT, "assessment.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    for name in ("assessment_pkg", "assessment_pkg.db", "assessment_pkg.assessment"):
+        sys.modules.pop(name, None)
+
+
+PHQ9_BANDS = [
+    {"min_score": 0, "label": "Minimal Depression"},
+    {"min_score": 5, "label": "Mild Depression"},
+    {"min_score": 10, "label": "Moderate Depression"},
+    {"min_score": 15, "label": "Moderately Severe Depression"},
+    {"min_score": 20, "label": "Severe Depression"},
+]
+
+
+@pytest.fixture
+def rules(assessment, monkeypatch):
+    phq = assessment._Rules()
+    phq.bands[None] = assessment._Bands(PHQ9_BANDS)
+
+    mixed = assessment._Rules()
+    mixed.bands[None] = assessment._Bands([{"min_score": 0, "label": "Low"}, {"min_score": 6, "label": "High"}])
+    mixed.bands["mood"] = assessment._Bands([{"min_score": 0, "label": "Calm"}, {"min_score": 3, "label": "Low mood"}])
+    mixed.subscale_of = {"q1": "mood", "q2": "mood", "q3": "sleep"}
+    mixed.reverse = {"q2": 0 + 3}    # options 0..3
+
+    monkeypatch.setattr(assessment, "_rules", {"phq9": phq, "mixed": mixed})
+    return assessment
+
+
+@pytest.mark.parametrize("score, label", [
+    (0, "Minimal Depression"),
+    (4, "Minimal Depression"),
+    (5, "Mild Depression"),
+    (14, "Moderate Depression"),
+    (15, "Moderately Severe Depression"),
+    (27, "Severe Depression"),
+])
+def test_band_boundaries(assessment, score, label):
+    assert assessment._Bands(PHQ9_BANDS).label(score) == label
+
+
+def test_bands_accept_unsorted_rows_and_reject_scores_below_the_first(assessment):
+    bands = assessment._Bands(list(reversed(PHQ9_BANDS)))
+    assert bands.label(12) == "Moderate Depression"
+    assert bands.label(-1) == assessment.UNAVAILABLE
+
+
+def test_total_score_and_label(rules):
+    answers = [{"question_id": f"q{i}", "value": 2} for i in range(6)]
+    scored = rules.score_answers("phq9", answers)
+    assert scored["score"] == 12
+    assert scored["result_text"] == "Moderate Depression"
+    assert scored["subscales"] == {}
+
+
+def test_reverse_scored_items_are_flipped_before_totalling(rules):
+    scored = rules.score_answers("mixed", [
+        {"question_id": "q1", "value": 1},
+        {"question_id": "q2", "value": 0},    # reversed: 3 - 0 = 3
+        {"question_id": "q3", "value": 2},
+    ])
+    assert scored["score"] == 6
+    assert scored["result_text"] == "High"
+    assert scored["subscales"]["mood"] == {"score": 4, "result_text": "Low mood"}
+
+
+def test_subscale_without_bands_is_unavailable(rules):
+    scored = rules.score_answers("mixed", [{"question_id": "q3", "value": 1}])
+    assert scored["subscales"]["sleep"] == {"score": 1, "result_text": rules.UNAVAILABLE}
+
+
+def test_unknown_assessment_is_unavailable(rules):
+    scored = rules.score_answers("nope", [{"question_id": "x", "value": 3}])
+    assert scored["score"] == 3
+    assert scored["result_text"] == rules.UNAVAILABLE
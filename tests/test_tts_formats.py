@@ -0,0 +1,62 @@
+import pytest
+
+from tts_formats import DEFAULT_FORMAT, FORMATS, media_type, negotiate
+
+FIREFOX_MEDIA_ACCEPT = "audio/webm,audio/ogg,audio/wav,audio/*;q=0.9,application/ogg;q=0.7,video/*;q=0.6,*/*;q=0.5"
+CHROME_MEDIA_ACCEPT = "*/*"
+
+
+def test_no_preference_gets_the_default():
+    assert negotiate() == DEFAULT_FORMAT
+
+
+@pytest.mark.parametrize("requested, expected", [
+    ("mp3", DEFAULT_FORMAT),
+    ("mp3-low", "mp3_22050_32"),
+    ("opus", "opus_48000_32"),
+    ("pcm", "pcm_16000"),
+    ("opus_48000_64", "opus_48000_64"),
+])
+def test_format_param_picks_alias_or_output_format(requested, expected):
+    assert negotiate(requested) == expected
+
+
+def test_unknown_format_param_is_rejected():
+    assert negotiate("flac") is None
+
+
+def test_format_param_wins_over_accept_and_save_data():
+    assert negotiate("pcm", "audio/ogg", "on") == "pcm_16000"
+
+
+@pytest.mark.parametrize("accept", [FIREFOX_MEDIA_ACCEPT, CHROME_MEDIA_ACCEPT, "audio/ogg, audio/*;q=0.8"])
+def test_browser_wildcard_accept_is_no_preference(accept):
+    assert negotiate(None, accept) == DEFAULT_FORMAT
+
+
+def test_explicit_accept_is_honoured_in_q_order():
+    assert negotiate(None, "audio/ogg") == "opus_48000_32"
+    assert negotiate(None, "audio/mpeg;q=0.5, audio/ogg") == "opus_48000_32"
+    assert negotiate(None, "audio/ogg;q=0.2, audio/mpeg") == DEFAULT_FORMAT
+
+
+def test_unmatched_explicit_accept_falls_back_to_default():
+    assert negotiate(None, "audio/webm") == DEFAULT_FORMAT
+
+
+def test_save_data_picks_low_bitrate_mp3():
+    assert negotiate(None, None, "on") == "mp3_22050_32"
+    assert negotiate(None, "audio/mpeg", "on") == "mp3_22050_32"
+    assert negotiate(None, FIREFOX_MEDIA_ACCEPT, "on") == "mp3_22050_32"
+    assert negotiate(None, "audio/ogg", "on") == "opus_48000_32"
+
+
+def test_l16_is_not_offered_for_little_endian_pcm():
+    assert negotiate(None, "audio/L16") == DEFAULT_FORMAT
+    for fmt in ("pcm_16000", "pcm_24000"):
+        assert media_type(fmt).startswith("audio/pcm;")
+        assert "s16le" in media_type(fmt)
+
+
+def test_every_format_has_a_media_type():
+    assert all(media_type(fmt) for fmt in FORMATS)
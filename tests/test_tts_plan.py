@@ -0,0 +1,57 @@
+import pytest
+
+from tts_plan import FIRST_MAX_CHARS, FIRST_MIN_CHARS, TARGET_CHARS, plan_snippets, split_sentences
+
+
+def words(text):
+    return text.split()
+
+
+def test_empty_text_has_no_snippets():
+    assert plan_snippets("") == []
+    assert plan_snippets("   ") == []
+
+
+def test_short_opener_is_its_own_snippet():
+    plan = plan_snippets("I hear you. That sounds really hard. Want to tell me more?")
+    assert plan[0] == "I hear you."
+    assert plan[1:] == ["That sounds really hard. Want to tell me more?"]
+
+
+def test_long_opener_is_split_at_a_clause_boundary():
+    opener = ("That sounds incredibly exhausting, especially when you've been carrying "
+              "it on your own for so long.")
+    assert len(opener) > FIRST_MAX_CHARS
+    plan = plan_snippets(opener + " What helps, even a little?")
+    assert plan[0] == "That sounds incredibly exhausting,"
+    assert len(plan[0]) >= FIRST_MIN_CHARS
+    assert plan[1].startswith("especially when")
+
+
+def test_opener_clause_shorter_than_the_minimum_is_not_split_off():
+    opener = "Yes, " + "that makes a lot of sense given everything you have described so far" + "."
+    plan = plan_snippets(opener)
+    assert plan == [opener]
+
+
+def test_later_sentences_are_merged_up_to_the_target():
+    text = "Okay. " + " ".join(f"Sentence number {i} is here." for i in range(40))
+    plan = plan_snippets(text)
+    assert len(plan) < len(split_sentences(text))
+    assert all(len(s) <= TARGET_CHARS for s in plan[1:])
+
+
+def test_a_single_sentence_longer_than_the_target_stays_whole():
+    long_sentence = "And " + "really " * 60 + "that matters."
+    plan = plan_snippets("Right. " + long_sentence)
+    assert plan == ["Right.", long_sentence]
+
+
+@pytest.mark.parametrize("text", [
+    "Yes.",
+    "I hear you. I hear you. I hear you.",
+    "That sounds incredibly exhausting, especially when you've been carrying it alone. "
+    "Many people feel this way! What would help right now?",
+])
+def test_plan_keeps_every_word_in_order(text):
+    assert words(" ".join(plan_snippets(text))) == words(text)
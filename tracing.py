@@ -0,0 +1,203 @@
+# tracing.py
+"""
+Realtime event traces and per-stage latency for the worker.
+
+With TRACE_PATH set, every user-row messages event the worker receives
+(INSERT, UPDATE, and rows picked up by a backfill) is appended to that file
+as one JSON line with its arrival offset:
+
+  {"t": 12.345, "event": "INSERT", "msg": {...}}
+
+Assistant rows are the worker's own output (one UPDATE per streamed token)
+and replay.py regenerates them, so they're not recorded.
+
+Rows are anonymized before they're written: ids and audio paths become
+salted hashes (a per-trace random salt that is never written out), and the
+transcription is reduced to what routing looks at – its length, the leading
+phrase the model router matches, and whether it has personal words, which
+keep a definition question out of the answer cache:
+
+  {"route": "what is", "words": 3, "chars": 15, "personal": false}
+
+No word of the text itself is kept. Crisis-screen matches are kept as a flag.
+
+Recording happens off the realtime event loop: record() stamps the event
+and queues a copy of the row; a writer thread anonymizes, writes and
+flushes. If the writer falls TRACE_QUEUE_MAX rows behind, new events are
+dropped and counted rather than blocking the loop.
+
+`stage_timings` collects duration samples for named stages of a turn
+(queue wait, payload build, first token, ...). It is always on; the worker
+reports it in its metrics and replay.py reports it after a replay.
+"""
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from clients import load_env
+from crisis import screen as crisis_screen
+
+load_env()
+
+TRACE_PATH       = os.getenv("TRACE_PATH")
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "200000"))
+TRACE_QUEUE_MAX  = 10_000     # rows waiting for the writer before new events are dropped
+STAGE_SAMPLES    = 10_000     # newest samples kept per stage
+
+# fields copied verbatim; everything else on the row is dropped
+KEEP_FIELDS = (
+    "sender_role", "ai_status", "ai_started", "transcription_status", "tts_status",
+    "invalidated", "created_at", "updated_at", "edited_at",
+)
+# leading phrases the model router and answer cache match on, longest first
+ROUTE_PREFIXES = sorted((
+    "what is", "define", "i feel", "i’m feeling", "i am feeling", "i am", "i'm",
+    "why", "how", "explain", "describe", "compare", "recommend", "suggest",
+), key=len, reverse=True)
+# words that make a definition question personal (never answered from cache)
+PERSONAL_WORDS = {
+    "i", "me", "my", "mine", "myself", "i'm", "i’m", "im", "you", "your", "yours",
+    "we", "us", "our", "he", "she", "they", "him", "her", "them", "his", "their",
+}
+
+
+class TraceRecorder:
+    def __init__(self, path, max_events=TRACE_MAX_EVENTS):
+        self.path = path
+        self.max_events = max_events
+        self.salt = os.urandom(16)
+        self.started = time.monotonic()
+        self.events = 0
+        self.dropped = 0
+        self.file = open(path, "a", encoding="utf-8") if path else None
+        self.queue = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+        if self.file is not None:
+            threading.Thread(target=self._write_loop, name="trace-writer", daemon=True).start()
+            atexit.register(self.close)
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def record(self, event, msg):
+        """Queue one event for the writer; cheap enough for the event loop."""
+        if self.file is None or msg.get("sender_role") != "user":
+            return
+        try:
+            self.queue.put_nowait((round(time.monotonic() - self.started, 4), event, dict(msg)))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write out whatever is still queued and stop recording."""
+        if self.file is not None:
+            self.queue.put(None)
+            self.queue.join()
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    self._stop()
+                    return
+                if self.file is None:
+                    continue
+                t, event, msg = item
+                self.file.write(json.dumps({"t": t, "event": event, "msg": self.anonymize(msg)}) + "\n")
+                self.events += 1
+                if self.events >= self.max_events:
+                    print(f"🎞️ Trace {self.path} reached {self.max_events} events; recording stopped")
+                    self._stop()
+                elif self.queue.empty():
+                    self.file.flush()
+            finally:
+                self.queue.task_done()
+
+    def _stop(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _hash(self, prefix, value, n=12):
+        if not value:
+            return value
+        return prefix + hashlib.sha256(self.salt + str(value).encode()).hexdigest()[:n]
+
+    @staticmethod
+    def _text_shape(text):
+        if not text:
+            return text
+        lc = text.lower()
+        words = [w.strip(".,!?;:\"") for w in lc.split()]
+        return {
+            "route": next((p for p in ROUTE_PREFIXES if lc == p or lc.startswith(p + " ")), None),
+            "words": len(words),
+            "chars": len(text),
+            "personal": not PERSONAL_WORDS.isdisjoint(words),
+        }
+
+    def anonymize(self, msg):
+        row = {k: msg.get(k) for k in KEEP_FIELDS if k in msg}
+        row["id"] = self._hash("m-", msg.get("id"))
+        row["conversation_id"] = self._hash("c-", msg.get("conversation_id"))
+        if msg.get("audio_path"):
+            row["audio_path"] = self._hash("a-", msg["audio_path"])
+        row["transcription"] = self._text_shape(msg.get("transcription"))
+        if crisis_screen(msg.get("transcription") or ""):
+            row["crisis"] = True
+        return row
+
+
+class StageTimings:
+    def __init__(self, max_samples=STAGE_SAMPLES):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.samples = {}     # stage -> deque of seconds
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        """{stage: {count, p50_ms, p90_ms, p99_ms, max_ms}}"""
+        with self.lock:
+            snapshot = {k: sorted(v) for k, v in self.samples.items()}
+        out = {}
+        for stage, values in snapshot.items():
+            if not values:
+                continue
+            pct = lambda p: values[min(int(len(values) * p), len(values) - 1)] * 1000
+            out[stage] = {
+                "count": len(values),
+                "p50_ms": round(pct(0.50), 1),
+                "p90_ms": round(pct(0.90), 1),
+                "p99_ms": round(pct(0.99), 1),
+                "max_ms": round(values[-1] * 1000, 1),
+            }
+        return out
+
+
+trace_recorder = TraceRecorder(TRACE_PATH)
+stage_timings = StageTimings()
@@ -0,0 +1,115 @@
+# tts_formats.py
+"""
+Audio output formats we let clients negotiate for TTS streaming.
+
+A client picks a format with ?format= (an alias below or an ElevenLabs
+output_format name) or through an Accept header that lists only concrete
+audio types; `Save-Data: on` picks the low-bitrate MP3. Everything else gets
+ElevenLabs' default MP3. Browsers send a generic media Accept with wildcards
+on every <audio> request (Firefox leads with audio/webm,audio/ogg), so a
+header carrying */* or audio/* is treated as no preference rather than as a
+request for Opus.
+
+Run `python tts_formats.py` to measure bytes per second of speech for each
+format against ElevenLabs (needs ELEVENLABS_API_KEY / ELEVENLABS_VOICE_ID).
+"""
+
+DEFAULT_FORMAT = "mp3_44100_128"
+
+# ElevenLabs output_format -> (media type, nominal bytes/s). ElevenLabs PCM is
+# 16-bit little-endian, so it isn't audio/L16 (big-endian by definition).
+FORMATS = {
+    "mp3_44100_128": ("audio/mpeg", 16_000),
+    "mp3_44100_64":  ("audio/mpeg", 8_000),
+    "mp3_22050_32":  ("audio/mpeg", 4_000),
+    "opus_48000_32": ("audio/ogg; codecs=opus", 4_000),
+    "opus_48000_64": ("audio/ogg; codecs=opus", 8_000),
+    "pcm_16000":     ("audio/pcm; rate=16000; channels=1; encoding=s16le", 32_000),
+    "pcm_24000":     ("audio/pcm; rate=24000; channels=1; encoding=s16le", 48_000),
+}
+
+ALIASES = {
+    "mp3":     DEFAULT_FORMAT,
+    "mp3-low": "mp3_22050_32",
+    "opus":    "opus_48000_32",
+    "pcm":     "pcm_16000",
+}
+
+# Accept media range -> format, checked in the client's preference order
+_ACCEPT = {
+    "audio/ogg":  "opus_48000_32",
+    "audio/opus": "opus_48000_32",
+    "audio/pcm":  "pcm_16000",
+    "audio/mpeg": DEFAULT_FORMAT,
+}
+
+
+def negotiate(requested=None, accept=None, save_data=None):
+    """
+    Pick an output format. Returns the ElevenLabs output_format name, or
+    None if `requested` names a format we don't support.
+    """
+    if requested:
+        fmt = ALIASES.get(requested, requested)
+        return fmt if fmt in FORMATS else None
+
+    if accept and "*" not in accept:
+        ranges = []
+        for i, part in enumerate(accept.split(",")):
+            media, _, params = part.strip().partition(";")
+            q = 1.0
+            for p in params.split(";"):
+                k, _, v = p.strip().partition("=")
+                if k == "q":
+                    try:
+                        q = float(v)
+                    except ValueError:
+                        pass
+            ranges.append((-q, i, media.strip().lower()))
+        for _, _, media in sorted(ranges):
+            if media in _ACCEPT:
+                fmt = _ACCEPT[media]
+                if fmt == DEFAULT_FORMAT and (save_data or "").lower() == "on":
+                    return "mp3_22050_32"
+                return fmt
+
+    if (save_data or "").lower() == "on":
+        return "mp3_22050_32"
+    return DEFAULT_FORMAT
+
+
+def media_type(fmt):
+    return FORMATS[fmt][0]
+
+
+# ─── BANDWIDTH BENCHMARK ────────────────────────────────────────────────────
+if __name__ == "__main__":
+    import os
+    import requests
+
+    SAMPLE = (
+        "That sounds so uncomfortable. Feeling that kind of pressure in social "
+        "situations can be really overwhelming. What do you think makes those "
+        "moments feel especially intense for you?"
+    )
+    voice_id = os.environ["ELEVENLABS_VOICE_ID"]
+    sess = requests.Session()
+    sess.headers.update({"xi-api-key": os.environ["ELEVENLABS_API_KEY"], "Content-Type": "application/json"})
+
+    def synth(fmt):
+        resp = sess.post(
+            f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+            params={"output_format": fmt},
+            json={"text": SAMPLE, "voice_settings": {"stability": 0.45, "similarity_boost": 0.45}},
+            timeout=(5, 60),
+        )
+        resp.raise_for_status()
+        return len(resp.content)
+
+    # 16-bit mono PCM gives us the exact speech duration to normalize by
+    seconds = synth("pcm_16000") / 32_000
+    print(f"sample: {seconds:.2f} s of speech")
+    for fmt in FORMATS:
+        size = synth(fmt)
+        print(f"{fmt:>14}: {size:>8} bytes  {size / seconds:>8.0f} B/s  "
+              f"({size / seconds * 8 / 1000:.0f} kbps)")
@@ -0,0 +1,114 @@
+# tts_plan.py
+"""
+Chunk planner for TTS snippets.
+
+The first snippet is kept as short as possible, split at a clause boundary
+if the opening sentence is long, so audio starts quickly. Later sentences
+are merged up to TARGET_CHARS so short replies ("Yes." "I hear you.") don't
+each pay for an upstream request and a prosody break.
+
+Run `python tts_plan.py [corpus.jsonl]` to compare the planner with the old
+one-snippet-per-sentence split on a corpus of replies ({"text": ...} per
+line, default tts_corpus.jsonl). Add --live to also time real first-audio
+latency against ElevenLabs (needs ELEVENLABS_API_KEY / ELEVENLABS_VOICE_ID).
+"""
+import re
+
+FIRST_MIN_CHARS = 12    # don't split the opener into a fragment shorter than this
+FIRST_MAX_CHARS = 60    # opening sentences longer than this get split at a clause
+TARGET_CHARS    = 220   # later snippets are merged up to about this length
+
+_SENT_SPLIT   = re.compile(r"(?<=[.!?])\s+")
+_CLAUSE_SPLIT = re.compile(r"(?<=[,;:—–])\s+")
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENT_SPLIT.split(text) if s.strip()]
+
+
+def _split_opener(sentence):
+    """(head, tail) at the first clause boundary leaving at least FIRST_MIN_CHARS, else (sentence, "")."""
+    if len(sentence) <= FIRST_MAX_CHARS:
+        return sentence, ""
+    for m in _CLAUSE_SPLIT.finditer(sentence):
+        head = sentence[:m.start()].strip()
+        if len(head) >= FIRST_MIN_CHARS:
+            return head, sentence[m.end():].strip()
+    return sentence, ""
+
+
+def plan_snippets(text):
+    """Split sanitized reply text into the snippets we synthesize, in order."""
+    sentences = split_sentences(text)
+    if not sentences:
+        return []
+
+    head, tail = _split_opener(sentences[0])
+    plan = [head]
+    rest = ([tail] if tail else []) + sentences[1:]
+
+    current = ""
+    for sentence in rest:
+        if current and len(current) + 1 + len(sentence) > TARGET_CHARS:
+            plan.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        plan.append(current)
+    return plan
+
+
+# ─── BENCHMARK ──────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    import json
+    import os
+    import statistics
+    import sys
+    import time
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    live = "--live" in sys.argv
+    corpus_path = args[0] if args else os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_corpus.jsonl")
+    with open(corpus_path) as f:
+        replies = [json.loads(line)["text"] for line in f if line.strip()]
+
+    old_plans = [split_sentences(r) for r in replies]
+    new_plans = [plan_snippets(r) for r in replies]
+
+    def summary(name, plans):
+        calls = [len(p) for p in plans]
+        first = [len(p[0]) for p in plans if p]
+        print(f"{name:>10}: {statistics.mean(calls):.2f} upstream calls/message "
+              f"(total {sum(calls)}), first snippet {statistics.mean(first):.0f} chars avg, "
+              f"{max(first)} max")
+
+    print(f"corpus: {len(replies)} replies")
+    summary("sentences", old_plans)
+    summary("planner", new_plans)
+
+    if live:
+        import requests
+
+        voice_id = os.environ["ELEVENLABS_VOICE_ID"]
+        sess = requests.Session()
+        sess.headers.update({"xi-api-key": os.environ["ELEVENLABS_API_KEY"], "Content-Type": "application/json"})
+
+        def first_audio_ms(piece):
+            started = time.perf_counter()
+            resp = sess.post(
+                f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream",
+                json={"text": piece, "voice_settings": {"stability": 0.45, "similarity_boost": 0.45}},
+                stream=True,
+                timeout=(5, 30),
+            )
+            resp.raise_for_status()
+            next(resp.iter_content(chunk_size=1_024))
+            elapsed = (time.perf_counter() - started) * 1000
+            resp.close()
+            return elapsed
+
+        for name, plans in (("sentences", old_plans), ("planner", new_plans)):
+            ttfa = sorted(first_audio_ms(p[0]) for p in plans if p)
+            print(f"{name:>10}: time to first audio p50 {ttfa[len(ttfa) // 2]:.0f} ms, "
+                  f"p90 {ttfa[int(len(ttfa) * 0.9)]:.0f} ms")
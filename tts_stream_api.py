@@ -1,26 +1,25 @@
 # tts_stream_api.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from dotenv import load_dotenv
-import os, requests, re
-from supabase import create_client
+from starlette.background import BackgroundTask
+import os, re, asyncio, threading, hashlib, json
+from collections import OrderedDict
+from typing import Optional
+from clients import load_env, supabase, eleven_sess
+from ratelimit import limiter, VOICE
+from tts_plan import plan_snippets
+from tts_formats import negotiate, media_type, FORMATS, ALIASES, DEFAULT_FORMAT
+from admission import AdmissionController
+import usage
 
-load_dotenv()
+load_env()
 
-SUPABASE_URL              = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 ELEVENLABS_VOICE_ID       = os.getenv("ELEVENLABS_VOICE_ID")
-ELEVENLABS_API_KEY        = os.getenv("ELEVENLABS_API_KEY")
 
-# reuse a single Session for all ElevenLabs calls
-eleven_sess = requests.Session()
-eleven_sess.headers.update({
-    "xi-api-key": ELEVENLABS_API_KEY,
-    "Content-Type": "application/json",
-})
-
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# supabase and the shared ElevenLabs session (one Session for all calls)
+# are created on first use, see clients.py
 
 app = FastAPI()
 app.add_middleware(
@@ -28,6 +27,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["GET"],
     allow_headers=["*"],
+    expose_headers=["X-Snippet-Count", "X-Audio-Format"],
 )
 
 # ─── WARM-UP POOL ────────────────────────────────────────────────────────────
@@ -62,32 +62,64 @@ def warmup_elevenlabs_pool():
         pass
 
 
-@app.get("/tts-stream/{message_id}")
-async def tts_stream(message_id: str, snippet: int = 0):
-    # 1) fetch & sanitize
-    msg = (
+# ─── SHARED HELPERS ──────────────────────────────────────────────────────────
+_SANITIZE   = re.compile(r"[*/{}\[\]<>&#@_\\|+=%]")
+
+TTS_PREFETCH = int(os.getenv("TTS_PREFETCH", "3"))   # snippets synthesized ahead of the one being sent
+
+# concurrent snippet streams we consider full load; new ones are refused when shedding
+tts_admission = AdmissionController("tts", int(os.getenv("TTS_MAX_STREAMS", "32")))
+
+def admit_stream():
+    if not tts_admission.try_admit():
+        raise HTTPException(503, "TTS is overloaded, retry shortly", headers={"Retry-After": "1"})
+
+def release_after(chunks):
+    """
+    Hold the admission slot until the stream is fully sent or abandoned.
+    Returns (generator, release). The generator releases when it finishes
+    or is closed. Pass release to the response as a background task too:
+    a generator that never started has no finally to run. release() is
+    idempotent, so the slot is freed exactly once.
+    """
+    lock = threading.Lock()
+    released = False
+
+    def release():
+        nonlocal released
+        with lock:
+            if released:
+                return
+            released = True
+        tts_admission.finish()
+
+    def relay():
+        try:
+            yield from chunks
+        finally:
+            release()
+    return relay(), release
+
+def load_message_context(message_id: str):
+    """
+    Fetch a reply's text and the voice to speak it with.
+    Returns (snippets, voice_id); raises HTTPException like the HTTP route.
+    """
+    rows = (
         supabase
         .table("messages")
         .select("assistant_text,conversation_id")
         .eq("id", message_id)
-        .single()
+        .limit(1)
         .execute()
         .data
-    ) or {}
+    )
+    msg = rows[0] if rows else {}
     text = msg.get("assistant_text", "")
     if not text:
         raise HTTPException(404, "No assistant_text for that message")
 
-    sanitized = re.sub(r"[*/{}\[\]<>&#@_\\|+=%]", "", text)
-
-    # split into sentences (keep the delimiter on the end)
-    sentences = re.split(r'(?<=[.!?])\s+', sanitized)
-    if snippet < 0 or snippet >= len(sentences):
-        raise HTTPException(400, f"snippet index {snippet} out of range")
-    piece = sentences[snippet].strip()
-
-    # 2) confirm voice mode
-    # pull voice_enabled + therapist_id
+    # confirm voice mode & pull therapist_id
     convo = (
         supabase
         .table("conversations")
@@ -97,62 +129,276 @@ async def tts_stream(message_id: str, snippet: int = 0):
         .execute()
         .data
     ) or {}
-
     if not convo.get("voice_enabled"):
         raise HTTPException(403, "TTS only in Voice Mode")
 
-    # 2) confirm voice mode & pull therapist_id
-    convo_resp = (
-        supabase
-        .table("conversations")
-        .select("voice_enabled, therapist_id")
-        .eq("id", msg["conversation_id"])
-        .single()
-        .execute()
-    )
-    convo = convo_resp.data or {}
-    if not convo.get("voice_enabled"):
-        raise HTTPException(403, "TTS only in Voice Mode")
-    
-    # 3) look up the therapist’s voice_id (or fallback to ENV)
+    # look up the therapist’s voice_id (or fallback to ENV)
     therapist_id = convo.get("therapist_id")
     if therapist_id:
-        therapist_resp = (
+        therapist_row = (
             supabase
             .table("therapists")
             .select("elevenlabs_voice_id")
             .eq("id", therapist_id)
             .single()
             .execute()
-        )
-        therapist_row = therapist_resp.data or {}
+            .data
+        ) or {}
         voice_id = therapist_row.get("elevenlabs_voice_id") or ELEVENLABS_VOICE_ID
     else:
         voice_id = ELEVENLABS_VOICE_ID
 
+    # short opener, later sentences merged (see tts_plan.py)
+    snippets = plan_snippets(_SANITIZE.sub("", text))
+    return snippets, voice_id
 
-    # 3) proxy the streaming POST
-    upstream = eleven_sess.post(
-        f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-        json={
-            "text": piece,
-            "voice_settings": {
-                "stability": 0.45,
-                "similarity_boost": 0.45,
-                "latency_boost": True,
+def open_upstream(piece: str, voice_id: str, fmt: str = DEFAULT_FORMAT):
+    """Start a streaming ElevenLabs synthesis for one snippet."""
+    def post():
+        resp = eleven_sess.post(
+            f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
+            params={"output_format": fmt},
+            json={
+                "text": piece,
+                "voice_settings": {
+                    "stability": 0.45,
+                    "similarity_boost": 0.45,
+                    "latency_boost": True,
+                },
+                "stream": True,
             },
-            "stream": True,
-        },
-        stream=True,
-        timeout=(5, None),
-    )
-    upstream.raise_for_status()
+            stream=True,
+            timeout=(5, None),
+        )
+        resp.raise_for_status()
+        return resp
+
+    return limiter.call("elevenlabs", voice_id, VOICE, post)
+
+
+# ─── AUDIO CACHE ─────────────────────────────────────────────────────────────
+# Finished snippets are kept so replays, retries and the WebSocket's
+# from_snippet restarts don't synthesize the same audio again. The key
+# includes the output format: the same sentence as Opus and as MP3 are
+# different bytes.
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_audio_cache = OrderedDict()    # (voice_id, fmt, sha1(text)) -> bytes
+_audio_cache_bytes = 0
+_audio_cache_lock = threading.Lock()
 
+def _audio_key(piece, voice_id, fmt):
+    return (voice_id, fmt, hashlib.sha1(piece.encode()).hexdigest())
+
+def _audio_cache_get(key):
+    with _audio_cache_lock:
+        audio = _audio_cache.get(key)
+        if audio is not None:
+            _audio_cache.move_to_end(key)
+        return audio
+
+def _audio_cache_put(key, audio):
+    global _audio_cache_bytes
+    with _audio_cache_lock:
+        if key in _audio_cache or len(audio) > AUDIO_CACHE_MAX_BYTES:
+            return
+        _audio_cache[key] = audio
+        _audio_cache_bytes += len(audio)
+        while _audio_cache_bytes > AUDIO_CACHE_MAX_BYTES:
+            _, old = _audio_cache.popitem(last=False)
+            _audio_cache_bytes -= len(old)
+
+def audio_stream(piece: str, voice_id: str, fmt: str, stop=None, message_id=None):
+    """
+    Iterator of audio chunks for one snippet, from the cache or upstream.
+    The upstream request is opened eagerly so HTTP errors surface before
+    the response starts; a fully streamed snippet is added to the cache.
+    Only upstream syntheses are billed, so only they are recorded in usage.
+    """
+    key = _audio_key(piece, voice_id, fmt)
+    cached = _audio_cache_get(key)
+    if cached is not None:
+        return iter([cached])
+
+    upstream = open_upstream(piece, voice_id, fmt)
+    usage.record("elevenlabs", voice_id, "tts", characters=len(piece), message_id=message_id)
+
+    def relay():
+        parts = []
+        try:
+            for chunk in upstream.iter_content(chunk_size=4_096):
+                if stop is not None and stop.is_set():
+                    return
+                if chunk:
+                    parts.append(chunk)
+                    yield chunk
+            _audio_cache_put(key, b"".join(parts))
+        finally:
+            upstream.close()
+    return relay()
+
+def negotiate_format(request: Request, requested: Optional[str]) -> str:
+    fmt = negotiate(requested, request.headers.get("accept"), request.headers.get("save-data"))
+    if fmt is None:
+        raise HTTPException(400, f"unsupported format {requested!r}; choose one of {sorted(FORMATS) + sorted(ALIASES)}")
+    return fmt
+
+
+@app.get("/tts-stream/{message_id}")
+async def tts_stream(message_id: str, request: Request, snippet: int = 0, format: Optional[str] = None):
+    fmt = negotiate_format(request, format)
+    snippets, voice_id = await run_in_threadpool(load_message_context, message_id)
+    if snippet < 0 or snippet >= len(snippets):
+        raise HTTPException(400, f"snippet index {snippet} out of range")
+
+    admit_stream()
+    try:
+        # limiter waits and retry backoffs sleep; keep them off the event loop
+        chunks = await run_in_threadpool(audio_stream, snippets[snippet], voice_id, fmt, message_id=message_id)
+    except Exception:
+        tts_admission.finish()
+        raise
+
+    body, release = release_after(chunks)
     return StreamingResponse(
-        upstream.iter_content(chunk_size=4_096),
-        media_type="audio/mpeg",
+        body,
+        background=BackgroundTask(release),
+        media_type=media_type(fmt),
         headers={
             "Cache-Control": "no-cache, no-store, must-revalidate",
             "Transfer-Encoding": "chunked",
+            "X-Snippet-Count": str(len(snippets)),
+            "X-Audio-Format": fmt,
+            "Vary": "Accept, Save-Data",
         }
     )
+
+
+@app.get("/metrics")
+async def metrics():
+    with _audio_cache_lock:
+        cache = {"entries": len(_audio_cache), "bytes": _audio_cache_bytes}
+    return {"tts_admission": tts_admission.stats(), "audio_cache": cache, "rate_limiter": dict(limiter.stats)}
+
+
+@app.get("/tts-plan/{message_id}")
+async def tts_plan(message_id: str):
+    """How a reply will be split, so the client knows how many snippets to request."""
+    snippets, _ = await run_in_threadpool(load_message_context, message_id)
+    return {"message_id": message_id, "count": len(snippets), "snippets": snippets}
+
+
+# ─── MULTI-SNIPPET WEBSOCKET ─────────────────────────────────────────────────
+# One connection streams every snippet of one or more replies. The client
+# sends {"message_id": "...", "from_snippet": 0} for each reply it wants
+# (e.g. each new assistant turn of the conversation) and receives, in order:
+#   {"type": "snippet_start", "message_id", "index", "count", "text", "format"}
+#   binary audio frames (format negotiated once per connection, see tts_formats.py)
+#   {"type": "snippet_end", "message_id", "index"}
+#   ...
+#   {"type": "message_end", "message_id"}
+# Errors arrive as {"type": "error", "message_id", "status", "detail"}.
+# Up to TTS_PREFETCH snippets are synthesized upstream in parallel while
+# earlier ones are still being sent.
+
+def _produce(loop, queue, stop, piece, voice_id, fmt, message_id):
+    """Pump one snippet's audio into an asyncio queue (runs in a worker thread)."""
+    put = lambda item: loop.call_soon_threadsafe(queue.put_nowait, item)
+    try:
+        for chunk in audio_stream(piece, voice_id, fmt, stop, message_id):
+            put(chunk)
+        put(None)
+    except Exception as e:
+        put(e)
+
+async def stream_message(ws: WebSocket, message_id: str, from_snippet: int = 0, fmt: str = DEFAULT_FORMAT):
+    try:
+        snippets, voice_id = await run_in_threadpool(load_message_context, message_id)
+        admit_stream()
+    except HTTPException as e:
+        await ws.send_json({"type": "error", "message_id": message_id, "status": e.status_code, "detail": e.detail})
+        return
+    except Exception as e:
+        print(f"❌ TTS context error for {message_id}:", e)
+        await ws.send_json({"type": "error", "message_id": message_id, "status": 500, "detail": "could not load message"})
+        return
+
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    queues = {}
+    count = len(snippets)
+    from_snippet = max(from_snippet, 0)
+
+    def launch(i):
+        if i < count and i not in queues:
+            queues[i] = asyncio.Queue()
+            loop.run_in_executor(None, _produce, loop, queues[i], stop, snippets[i], voice_id, fmt, message_id)
+
+    try:
+        for i in range(from_snippet, min(from_snippet + TTS_PREFETCH, count)):
+            launch(i)
+        for i in range(from_snippet, count):
+            launch(i)
+            await ws.send_json({
+                "type": "snippet_start", "message_id": message_id,
+                "index": i, "count": count, "text": snippets[i], "format": fmt,
+            })
+            queue = queues.pop(i)
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    await ws.send_json({"type": "error", "message_id": message_id, "status": 502, "detail": str(item)})
+                    break
+                await ws.send_bytes(item)
+            await ws.send_json({"type": "snippet_end", "message_id": message_id, "index": i})
+            launch(i + TTS_PREFETCH)
+        await ws.send_json({"type": "message_end", "message_id": message_id})
+    finally:
+        # client went away or we're done: stop any synthesis still running
+        stop.set()
+        tts_admission.finish()
+
+
+def parse_ws_request(raw: str) -> dict:
+    """{"message_id", "from_snippet"} from a client frame, or {"error": ...} (plus message_id if known)."""
+    try:
+        req = json.loads(raw)
+    except ValueError:
+        return {"error": "request must be JSON"}
+    if not isinstance(req, dict):
+        return {"error": "request must be a JSON object"}
+    message_id = req.get("message_id")
+    if not isinstance(message_id, str) or not message_id:
+        return {"error": "message_id is required"}
+    try:
+        from_snippet = int(req.get("from_snippet", 0))
+    except (TypeError, ValueError):
+        return {"error": "from_snippet must be an integer", "message_id": message_id}
+    return {"message_id": message_id, "from_snippet": from_snippet}
+
+
+@app.websocket("/tts-ws")
+async def tts_ws(ws: WebSocket, format: Optional[str] = None):
+    fmt = negotiate(format, ws.headers.get("accept"), ws.headers.get("save-data"))
+    if fmt is None:
+        await ws.close(code=1003, reason=f"unsupported format {format!r}")
+        return
+    await ws.accept()
+    try:
+        while True:
+            req = parse_ws_request(await ws.receive_text())
+            if "error" in req:
+                await ws.send_json({"type": "error", "message_id": req.get("message_id"), "status": 400, "detail": req["error"]})
+                continue
+            try:
+                await stream_message(ws, req["message_id"], req["from_snippet"], fmt)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # one bad reply shouldn't end the connection for the rest
+                print(f"❌ TTS stream error for {req['message_id']}:", e)
+                await ws.send_json({"type": "error", "message_id": req["message_id"], "status": 500, "detail": "stream failed"})
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,136 @@
+# usage.py
+"""
+Token, audio and character accounting for every OpenAI and ElevenLabs call.
+
+Call sites record usage with `record(...)` / `record_openai(...)`; records
+are tagged with the message and conversation set by `tag(...)` for the
+current thread, buffered in memory and appended to llm_usage in batches by
+a background flusher, so accounting never adds a round trip to a turn.
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from clients import load_env, supabase
+
+load_env()
+
+USAGE_FLUSH_S     = float(os.getenv("USAGE_FLUSH_S", "5"))
+USAGE_BATCH_SIZE  = 200
+USAGE_MAX_BUFFER  = 10_000   # drop oldest records beyond this if the DB is unreachable
+
+# USD list prices: per 1K prompt / completion tokens, per audio minute, per 1K characters
+PRICES = {
+    "gpt-4-turbo":            {"prompt": 0.01, "completion": 0.03},
+    "gpt-3.5-turbo":          {"prompt": 0.0005, "completion": 0.0015},
+    "text-embedding-3-small": {"prompt": 0.00002, "completion": 0.0},
+    "whisper-1":              {"audio_minute": 0.006},
+    "elevenlabs":             {"characters_1k": float(os.getenv("ELEVENLABS_PRICE_PER_1K_CHARS", "0.30"))},
+}
+
+_context = threading.local()
+_buffer = []
+_buffer_lock = threading.Lock()
+_flusher = None
+
+
+def tag(message_id=None, conversation_id=None):
+    """Attribute subsequent usage on this thread to a message / conversation."""
+    _context.message_id = message_id
+    _context.conversation_id = conversation_id
+
+
+def current_tag():
+    """(message_id, conversation_id) usage on this thread is attributed to, for handing to another thread."""
+    return getattr(_context, "message_id", None), getattr(_context, "conversation_id", None)
+
+
+def cost_usd(model, prompt_tokens=0, completion_tokens=0, audio_seconds=None, characters=None):
+    price = PRICES.get(model) or PRICES.get("elevenlabs" if characters else model, {})
+    cost = (prompt_tokens or 0) / 1000 * price.get("prompt", 0.0)
+    cost += (completion_tokens or 0) / 1000 * price.get("completion", 0.0)
+    cost += (audio_seconds or 0) / 60 * price.get("audio_minute", 0.0)
+    cost += (characters or 0) / 1000 * price.get("characters_1k", 0.0)
+    return round(cost, 6)
+
+
+def record(provider, model, purpose, prompt_tokens=0, completion_tokens=0,
+           audio_seconds=None, characters=None, message_id=None, conversation_id=None):
+    row = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "provider": provider,
+        "model": model,
+        "purpose": purpose,
+        "message_id": message_id or getattr(_context, "message_id", None),
+        "conversation_id": conversation_id or getattr(_context, "conversation_id", None),
+        "prompt_tokens": prompt_tokens or 0,
+        "completion_tokens": completion_tokens or 0,
+        "audio_seconds": audio_seconds,
+        "characters": characters,
+        "cost_usd": cost_usd(model, prompt_tokens, completion_tokens, audio_seconds, characters),
+    }
+    with _buffer_lock:
+        _buffer.append(row)
+        if len(_buffer) > USAGE_MAX_BUFFER:
+            del _buffer[:len(_buffer) - USAGE_MAX_BUFFER]
+        full = len(_buffer) >= USAGE_BATCH_SIZE
+    _ensure_flusher()
+    if full:
+        threading.Thread(target=flush, daemon=True).start()
+
+
+def record_openai(resp, model, purpose, usage=None):
+    """Record an OpenAI chat/embedding response (or a stream's final `usage` object)."""
+    usage = usage or getattr(resp, "usage", None)
+    if usage is None:
+        return
+    record(
+        "openai", model, purpose,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0),
+        completion_tokens=getattr(usage, "completion_tokens", 0),
+    )
+
+
+def flush():
+    with _buffer_lock:
+        batch = _buffer[:USAGE_BATCH_SIZE]
+        del _buffer[:USAGE_BATCH_SIZE]
+    if not batch:
+        return
+    try:
+        supabase.table("llm_usage").insert(batch).execute()
+    except Exception as e:
+        print(f"❌ Failed to write {len(batch)} usage records:", e)
+        with _buffer_lock:
+            _buffer[:0] = batch
+
+
+def drain():
+    """Flush until the buffer is empty or the DB stops accepting writes."""
+    while _buffer:
+        before = len(_buffer)
+        flush()
+        if len(_buffer) >= before:
+            break
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _buffer_lock:
+        if _flusher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(USAGE_FLUSH_S)
+                drain()
+
+        _flusher = threading.Thread(target=loop, name="usage-flusher", daemon=True)
+        _flusher.start()
+
+
+atexit.register(drain)
@@ -2,38 +2,42 @@ import os
 import io
 import json
 import threading
-import requests
 import asyncio
+import time
 from datetime import datetime, timezone, timedelta
-from dotenv import load_dotenv
-from supabase import create_client      # sync client for handlers
-from supabase._async.client import create_client as create_client_async  # async for realtime
-from openai import OpenAI
-from realtime import RealtimeSubscribeStates
+# clients are created lazily on first use, so importing this module
+# (e.g. from summarizer_api) doesn't pay for the worker's setup
+from clients import (
+    load_env, create_supabase_async,
+    supabase, supabase_admin, openai_client, storage_sess, eleven_sess,
+)
+from ratelimit import limiter, estimate_tokens, VOICE, CHAT, TRANSCRIPTION, BACKGROUND
+from crisis import screen as crisis_screen, CRISIS_RESPONSE
+from memory_index import recall, index_conversation
+from admission import AdmissionController
+import usage
+from tracing import trace_recorder, stage_timings
 import re 
+import random
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-# ─── CONFIG & CLIENTS ────────────────────────────────────────────────────────
-load_dotenv()
+# ─── CONFIG ──────────────────────────────────────────────────────────────────
+load_env()
 
 SUPABASE_URL        = os.getenv("SUPABASE_URL")
-SERVICE_ROLE_KEY    = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID")
-ELEVENLABS_API_KEY       = os.getenv("ELEVENLABS_API_KEY")
 
-
-# sync clients for your existing handlers
-supabase       = create_client(SUPABASE_URL, SERVICE_ROLE_KEY)
-supabase_admin = create_client(SUPABASE_URL, SERVICE_ROLE_KEY)
-
-# async client only for realtime
-# will be created inside `start_realtime()`
-
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# sync clients (supabase, supabase_admin, openai_client, sessions) come from
+# clients.py; the async client is only for realtime, created in start_realtime()
 
 def warmup_openai_models():
     for model in ("gpt-3.5-turbo", "gpt-4-turbo"):
         try:
-            openai_client.chat.completions.create(
+            resp = limiter.call(
+                "openai", model, BACKGROUND, openai_client.chat.completions.create,
+                tokens=1,
                 model=model,
                 messages=[
                     {"role":"system", "content":" "},
@@ -41,6 +45,7 @@ def warmup_openai_models():
                 ],
                 max_tokens=1
             )
+            usage.record_openai(resp, model, "warmup")
         except Exception:
             pass
 
@@ -55,14 +60,6 @@ _SENT_SPLIT = re.compile(r"([.!?]\s+)")
 _SANITIZE  = re.compile(r"[*/{}\[\]<>&#@_\\|+=%]")
 _SENT_COUNT= re.compile(r"[.!?]\s*")
 
-# Initialize sessions 
-storage_sess = requests.Session()
-eleven_sess = requests.Session()
-eleven_sess.headers.update({
-    "xi-api-key": ELEVENLABS_API_KEY,
-    "Content-Type": "application/json",
-})
-
 # ─── Your Custom Prompt & Examples ────────────────────────────────────────────
 DEFAULT_SYSTEM_PROMPT = """
 You are a compassionate, emotionally attuned AI therapist assistant. You respond with warmth, sensitivity, and care. 
@@ -155,6 +152,296 @@ FUNCTION_DEFS = [
     }
 ]
 
+# ─── CONVERSATION HISTORY CACHE ─────────────────────────────────────────────
+HISTORY_TAIL            = 60            # rows fetched on a miss and kept per conversation
+HISTORY_CACHE_MAX_CONVS = int(os.getenv("HISTORY_CACHE_MAX_CONVS", "500"))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_COLUMNS         = "id,sender_role,transcription,assistant_text,created_at"
+
+def _row_bytes(row):
+    # rough footprint: text payload plus a fixed per-row overhead
+    return len(row.get("transcription") or "") + len(row.get("assistant_text") or "") + 200
+
+class HistoryCache:
+    """
+    LRU of recent non-invalidated messages per conversation, kept current by
+    the realtime INSERT/UPDATE events the worker already receives.
+
+    Only used while the realtime channel is subscribed (`enabled`); when it
+    drops the cache is cleared, since events may have been missed. A miss
+    loads the newest HISTORY_TAIL rows; events that arrive during that load
+    are buffered and replayed on top of it.
+    """
+
+    def __init__(self, max_convs=HISTORY_CACHE_MAX_CONVS, max_bytes=HISTORY_CACHE_MAX_BYTES):
+        self.max_convs = max_convs
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.convs = OrderedDict()   # conv id -> {msg id: row}
+        self.loading = {}            # conv id -> events buffered during a miss
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def set_enabled(self, enabled):
+        with self.lock:
+            self.enabled = enabled
+            if not enabled:
+                self.convs.clear()
+                self.loading.clear()
+                self.bytes = 0
+
+    def get(self, conv_id):
+        with self.lock:
+            rows = self.convs.get(conv_id) if self.enabled else None
+            if rows is not None:
+                self.hits += 1
+                self.convs.move_to_end(conv_id)
+                return sorted(rows.values(), key=lambda r: r["created_at"])
+            self.misses += 1
+            caching = self.enabled
+            if caching:
+                self.loading.setdefault(conv_id, [])
+
+        tail = fetch_history_tail(conv_id)
+
+        if caching:
+            with self.lock:
+                buffered = self.loading.pop(conv_id, None)
+                if buffered is not None and self.enabled:
+                    self.convs[conv_id] = {r["id"]: r for r in tail}
+                    self.bytes += sum(_row_bytes(r) for r in tail)
+                    for record in buffered:
+                        self._apply(record)
+                    self._trim(conv_id)
+                    self._evict()
+                    return sorted(self.convs[conv_id].values(), key=lambda r: r["created_at"])
+        return tail
+
+    def apply_event(self, record):
+        conv_id = record.get("conversation_id")
+        with self.lock:
+            if conv_id in self.loading:
+                self.loading[conv_id].append(record)
+            elif conv_id in self.convs:
+                self._apply(record)
+                self._trim(conv_id)
+                self._evict()
+
+    def write(self, record):
+        """
+        Write-through for rows this worker just wrote, so the conversation's
+        next turn sees them without waiting for the realtime echo. Later
+        echoes of the same row (e.g. earlier streamed partials) can only
+        invalidate it, not overwrite it.
+        """
+        self.apply_event({**record, "_local": True})
+
+    def _apply(self, record):
+        rows = self.convs[record["conversation_id"]]
+        old = rows.get(record["id"])
+        if old and old.get("_local") and not record.get("_local") and not record.get("invalidated"):
+            return
+        if old:
+            del rows[record["id"]]
+            self.bytes -= _row_bytes(old)
+        if not record.get("invalidated"):
+            row = {k: record.get(k) for k in HISTORY_COLUMNS.split(",")}
+            if record.get("_local"):
+                row["_local"] = True
+            rows[record["id"]] = row
+            self.bytes += _row_bytes(row)
+
+    def _trim(self, conv_id):
+        rows = self.convs[conv_id]
+        if len(rows) > HISTORY_TAIL:
+            for r in sorted(rows.values(), key=lambda r: r["created_at"])[:len(rows) - HISTORY_TAIL]:
+                del rows[r["id"]]
+                self.bytes -= _row_bytes(r)
+
+    def _evict(self):
+        while self.convs and (len(self.convs) > self.max_convs or self.bytes > self.max_bytes):
+            _, rows = self.convs.popitem(last=False)
+            self.bytes -= sum(_row_bytes(r) for r in rows.values())
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "conversations": len(self.convs),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+def fetch_history_tail(conv_id, limit=HISTORY_TAIL):
+    """Newest `limit` non-invalidated rows, returned oldest first."""
+    rows = (
+        supabase
+        .table("messages")
+        .select(HISTORY_COLUMNS)
+        .eq("conversation_id", conv_id)
+        .eq("invalidated", False)
+        .order("created_at", desc=True)
+        .limit(limit)
+        .execute()
+        .data
+        or []
+    )
+    rows.reverse()
+    return rows
+
+history_cache = HistoryCache()
+
+# ─── DEFINITION ANSWER CACHE ────────────────────────────────────────────────
+# "what is anxiety" / "define mindfulness" get the same short answer for every
+# patient of a persona, so replies to that class are reused instead of
+# regenerated. Only terms on an explicit glossary qualify: "what is it",
+# "what is wrong" or "what is the point of living" point back at the
+# conversation or at how the patient feels, and go down the normal
+# history-aware path. Qualifying replies are generated from the persona prompt
+# alone (build_definition_payload) so no patient's context ends up in a shared
+# reply.
+ANSWER_CACHE_MAX     = int(os.getenv("ANSWER_CACHE_MAX", "2000"))
+ANSWER_CACHE_TTL_S   = int(os.getenv("ANSWER_CACHE_TTL_S", str(6 * 3600)))
+
+GLOSSARY_TERMS = frozenset({
+    "anxiety", "social anxiety", "generalized anxiety disorder", "depression",
+    "seasonal affective disorder", "bipolar disorder", "ptsd", "trauma", "ocd",
+    "adhd", "panic attack", "panic disorder", "phobia", "insomnia", "burnout",
+    "grief", "dissociation", "rumination", "catastrophizing", "cognitive distortion",
+    "imposter syndrome", "codependency", "attachment style", "emotional regulation",
+    "resilience", "mindfulness", "meditation", "grounding", "box breathing",
+    "breathwork", "journaling", "self-care", "self-compassion", "boundaries",
+    "cbt", "cognitive behavioral therapy", "dbt", "dialectical behavior therapy",
+    "act", "acceptance and commitment therapy", "emdr", "exposure therapy",
+    "psychotherapy", "phq-9", "gad-7",
+})
+
+_DEFINITION_PREFIX = re.compile(r"^(?:what\s+is|define)\s+")
+_NOT_WORD          = re.compile(r"[^\w\s'-]+")
+_ARTICLES          = {"a", "an", "the"}
+
+def normalize_definition_query(text):
+    """
+    Glossary term a definition question asks about, or None if it isn't one
+    we can answer for everyone: "What is the Anxiety?" -> "anxiety",
+    "define panic attacks" -> "panic attack", "what is it" -> None.
+    """
+    lc = " ".join(_NOT_WORD.sub(" ", text.lower().replace("’", "'")).split())
+    m = _DEFINITION_PREFIX.match(lc)
+    if not m:
+        return None
+    term = " ".join(w for w in lc[m.end():].split() if w not in _ARTICLES)
+    if term in GLOSSARY_TERMS:
+        return term
+    if term.endswith("s") and term[:-1] in GLOSSARY_TERMS:
+        return term[:-1]
+    return None
+
+
+class AnswerCache:
+    """
+    LRU + TTL of (therapist id, normalized term) -> reply text.
+
+    Entries remember the question and reply rows they came from, and are
+    dropped when either is invalidated (edits, abandoned replies). Like the
+    history cache it only serves while realtime is subscribed, since those
+    invalidations arrive as events.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX, ttl_s=ANSWER_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (text, stored at, {source msg ids})
+        self.sources = {}              # msg id -> key
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def set_enabled(self, enabled):
+        with self.lock:
+            self.enabled = enabled
+            if not enabled:
+                self.entries.clear()
+                self.sources.clear()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key) if self.enabled else None
+            if entry is not None and time.monotonic() - entry[1] > self.ttl_s:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, text, *source_ids):
+        with self.lock:
+            if not self.enabled or not text.strip():
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (text, time.monotonic(), set(source_ids))
+            for sid in source_ids:
+                self.sources[sid] = key
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_message(self, msg_id):
+        with self.lock:
+            key = self.sources.get(msg_id)
+            if key is not None:
+                self._drop(key)
+                self.invalidations += 1
+
+    def _drop(self, key):
+        _, _, source_ids = self.entries.pop(key)
+        for sid in source_ids:
+            self.sources.pop(sid, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+answer_cache = AnswerCache()
+
+# ─── METRICS ────────────────────────────────────────────────────────────────
+METRICS_INTERVAL_S = 300
+
+def metrics_snapshot():
+    return {
+        "history_cache": history_cache.stats(),
+        "rate_limiter": dict(limiter.stats),
+        "transcription_cache": transcription_cache_stats(),
+        "ai_admission": ai_admission.stats(),
+        "answer_cache": answer_cache.stats(),
+        "stages": stage_timings.summary(),
+    }
+
+def schedule_metrics(interval_s=METRICS_INTERVAL_S):
+    def job():
+        print("📊 Metrics:", json.dumps(metrics_snapshot()))
+        t = threading.Timer(interval_s, job)
+        t.daemon = True
+        t.start()
+    job()
+
 # ─── SYNC HELPERS & HANDLERS ────────────────────────────────────────────────
 def update_status(table, record_id, fields):
     supabase.table(table).update(fields).eq("id", record_id).execute()
@@ -162,43 +449,14 @@ def update_status(table, record_id, fields):
 def schedule_cleanup(interval_hours=1):
     def job():
         close_inactive_conversations()
+        try:
+            purge_transcription_cache()
+        except Exception as e:
+            print("❌ Failed to purge transcription cache:", e)
         threading.Timer(interval_hours * 3600, job).start()
     job()
 
-def build_chat_payload(conv_id: str, voice_mode: bool = False) -> list:
-    # Fetch any saved memory
-    meta = supabase.table("conversations") \
-        .select("memory_summary") \
-        .eq("id", conv_id) \
-        .single().execute().data or {}
-    memory = meta.get("memory_summary")
-
-    conv = supabase.table("conversations") \
-    .select("needs_resummarization") \
-    .eq("id", conv_id).single().execute().data
-    if conv and conv["needs_resummarization"]:
-        supabase.table("conversations") \
-        .update({"memory_summary": "", "needs_resummarization": False}) \
-        .eq("id", conv_id).execute()
-
-    # Fetch the message history
-    history = supabase.table("messages") \
-        .select("sender_role,transcription,assistant_text,created_at") \
-        .eq("conversation_id", conv_id) \
-        .eq("invalidated", False)  \
-        .order("created_at").execute().data or []
-
-     # fetch which therapist this convo is using
-    prompt_resp = (
-        supabase_admin
-        .table("conversations")
-        .select("therapist_id")
-        .eq("id", conv_id)
-        .single()
-        .execute()
-    )
-    therapist_id = prompt_resp.data.get("therapist_id") if prompt_resp.data else None
-
+def persona_system_prompt(therapist_id):
     # pull the raw override + structured fields in one go
     if therapist_id:
         trow = (
@@ -231,10 +489,80 @@ def build_chat_payload(conv_id: str, voice_mode: bool = False) -> list:
     # 3) fallback to your original generic prompt
     else:
         system_prompt = DEFAULT_SYSTEM_PROMPT
+    return system_prompt
+
+def build_definition_payload(therapist_id, question):
+    """
+    Persona-only payload for a cacheable definition question. It carries no
+    history, recalled moments or assessment scores, since the reply is
+    served to every patient of this persona from the answer cache.
+    """
+    return [{"role": "system", "content": persona_system_prompt(therapist_id)}] + SKY_EXAMPLE_DIALOG + [
+        {"role": "user", "content": question}
+    ]
+
+# memory recall (an embedding round trip) runs here while the payload's other queries run
+RECALL_WORKERS = 4
+_recall_pool = ThreadPoolExecutor(max_workers=RECALL_WORKERS, thread_name_prefix="recall")
+
+def _recall_tagged(tag, patient_id, text):
+    usage.tag(*tag)
+    return recall(patient_id, text)
+
+def build_chat_payload(conv_id: str, voice_mode: bool = False) -> list:
+    # Fetch any saved memory, plus the patient's assessment trends in the same query
+    meta = supabase.table("conversations") \
+        .select(f"memory_summary, patient_id, patients!conversations_patient_id_fkey({TREND_SELECT})") \
+        .eq("id", conv_id) \
+        .single().execute().data or {}
+    memory = meta.get("memory_summary")
+    trend_line = format_trend_line((meta.get("patients") or {}).get("assessment_trends") or [])
+
+    # Fetch the message history (served from memory while realtime is live)
+    history = history_cache.get(conv_id)
+
+    # Start pulling the most relevant moments from past sessions for the latest user turn
+    latest_user = next((m["transcription"] for m in reversed(history) if m["sender_role"] == "user"), None)
+    recalled = _recall_pool.submit(_recall_tagged, usage.current_tag(), meta.get("patient_id"), latest_user)
+
+    conv = supabase.table("conversations") \
+    .select("needs_resummarization") \
+    .eq("id", conv_id).single().execute().data
+    if conv and conv["needs_resummarization"]:
+        supabase.table("conversations") \
+        .update({"memory_summary": "", "needs_resummarization": False}) \
+        .eq("id", conv_id).execute()
+
+     # fetch which therapist this convo is using
+    prompt_resp = (
+        supabase_admin
+        .table("conversations")
+        .select("therapist_id")
+        .eq("id", conv_id)
+        .single()
+        .execute()
+    )
+    therapist_id = prompt_resp.data.get("therapist_id") if prompt_resp.data else None
+    system_prompt = persona_system_prompt(therapist_id)
 
     # now inject into the messages list
     messages = [{"role":"system", "content": system_prompt}] + SKY_EXAMPLE_DIALOG
 
+    # Let the model see recent scores before deciding on suggest_assessment
+    if trend_line:
+        messages.append({"role": "system", "content": f"Recent assessment scores: {trend_line}"})
+
+    try:
+        moments = recalled.result()
+    except Exception as e:
+        print(f"❌ Memory recall failed for conv {conv_id}:", e)
+        moments = []
+    if moments:
+        messages.append({
+            "role": "system",
+            "content": "Relevant moments from past sessions:\n" + "\n".join(f"- {m}" for m in moments)
+        })
+
     # If this is a brand-new session with a memory summary, inject it
     if memory and not history:
         messages.append({
@@ -252,14 +580,19 @@ def build_chat_payload(conv_id: str, voice_mode: bool = False) -> list:
 
     # If history is long, summarize older turns
     if len(turns) > MAX_HISTORY:
-        summary_resp = openai_client.chat.completions.create(
+        summary_messages = messages + [
+            {"role": "assistant", "content": "Please summarize the earlier conversation briefly."}
+        ] + turns[:-MAX_HISTORY]
+        summary_resp = limiter.call(
+            "openai", "gpt-4-turbo", VOICE if voice_mode else CHAT,
+            openai_client.chat.completions.create,
+            tokens=estimate_tokens(summary_messages, 600),
             model = "gpt-4-turbo" if voice_mode else "gpt-4-turbo",
-            messages=messages + [
-                {"role": "assistant", "content": "Please summarize the earlier conversation briefly."}
-            ] + turns[:-MAX_HISTORY],
+            messages=summary_messages,
             temperature=0.3,
             max_tokens=600
         )
+        usage.record_openai(summary_resp, "gpt-4-turbo", "history_summary")
         summary = summary_resp.choices[0].message.content
         messages += [
             {"role": "assistant", "content": f"Summary of earlier conversation: {summary}"}
@@ -270,57 +603,205 @@ def build_chat_payload(conv_id: str, voice_mode: bool = False) -> list:
     return messages
 
 
-def handle_transcription_record(msg):
-    print(f"📝 ⏳ Transcribing message {msg['id']}…")
+# ─── TRANSCRIPTION CACHE ────────────────────────────────────────────────────
+# Whisper results keyed by a SHA-256 of the audio bytes, shared by every
+# worker through the transcription_cache table. Client retries, re-uploads
+# and backlog reprocessing reuse the stored text instead of calling Whisper.
+TRANSCRIPTION_CACHE_TTL_H = int(os.getenv("TRANSCRIPTION_CACHE_TTL_H", "72"))
+
+transcription_stats = {"hits": 0, "misses": 0, "whisper_seconds_saved": 0.0}
+_transcribing = {}      # sha256 -> Event, so concurrent duplicates wait for one call
+_transcribing_lock = threading.Lock()
+
+def cached_transcription(digest):
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=TRANSCRIPTION_CACHE_TTL_H)
+    rows = (
+        supabase
+        .table("transcription_cache")
+        .select("transcription,duration_s")
+        .eq("audio_sha256", digest)
+        .gt("created_at", cutoff.isoformat())
+        .limit(1)
+        .execute()
+        .data
+    )
+    return rows[0] if rows else None
+
+def purge_transcription_cache():
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=TRANSCRIPTION_CACHE_TTL_H)
+    supabase.table("transcription_cache").delete().lt("created_at", cutoff.isoformat()).execute()
+
+def transcribe_audio(audio):
+    """Transcribe audio bytes, reusing a cached result for identical audio."""
+    digest = hashlib.sha256(audio).hexdigest()
+
+    with _transcribing_lock:
+        pending = _transcribing.get(digest)
+        if pending is None:
+            _transcribing[digest] = threading.Event()
+    if pending is not None:
+        pending.wait(timeout=120)
+
     try:
-        audio = download_audio(msg["audio_path"])
-        resp  = openai_client.audio.transcriptions.create(
+        hit = cached_transcription(digest)
+        if hit:
+            transcription_stats["hits"] += 1
+            transcription_stats["whisper_seconds_saved"] += hit.get("duration_s") or 0.0
+            return hit["transcription"]
+
+        transcription_stats["misses"] += 1
+        resp = limiter.call(
+            "openai", "whisper-1", TRANSCRIPTION, openai_client.audio.transcriptions.create,
             model="whisper-1",
-            file=io.BytesIO(audio)
+            file=io.BytesIO(audio),
+            response_format="verbose_json",
         )
+        usage.record("openai", "whisper-1", "transcription", audio_seconds=getattr(resp, "duration", None))
+        try:
+            supabase.table("transcription_cache").upsert({
+                "audio_sha256": digest,
+                "transcription": resp.text,
+                "duration_s": getattr(resp, "duration", None),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }).execute()
+        except Exception as e:
+            print("❌ Failed to cache transcription:", e)
+        return resp.text
+    finally:
+        if pending is None:
+            with _transcribing_lock:
+                _transcribing.pop(digest).set()
+
+def transcription_cache_stats():
+    lookups = transcription_stats["hits"] + transcription_stats["misses"]
+    return {
+        **transcription_stats,
+        "whisper_seconds_saved": round(transcription_stats["whisper_seconds_saved"], 1),
+        "hit_rate": round(transcription_stats["hits"] / lookups, 3) if lookups else None,
+    }
+
+
+def handle_transcription_record(msg):
+    usage.tag(message_id=msg["id"], conversation_id=msg["conversation_id"])
+    print(f"📝 ⏳ Transcribing message {msg['id']}…")
+    try:
+        with stage_timings.timed("download"):
+            audio = download_audio(msg["audio_path"])
+        with stage_timings.timed("transcribe"):
+            text = transcribe_audio(audio)
         update_status("messages", msg["id"], {
-            "transcription": resp.text,
+            "transcription": text,
             "transcription_status": "done"
         })
-        print(f"✅ Transcribed {msg['id']}: “{resp.text[:30]}…”")
+        print(f"✅ Transcribed {msg['id']}: “{text[:30]}…”")
     except Exception as e:
         update_status("messages", msg["id"], {"transcription_status": "error"})
         print(f"❌ Transcription error for {msg['id']}:", e)
 
 
-def handle_ai_record(msg):
+def insert_assistant_reply(conv_id, text, voice_mode):
+    """Write a finished assistant reply in one insert (voice replies get their snippet URL)."""
+    row = {
+        "conversation_id": conv_id,
+        "sender_role":     "assistant",
+        "assistant_text":  text,
+        "ai_status":       "done",
+        "ai_started":      False,
+        "tts_status":      "pending" if voice_mode else "done",
+    }
+    if voice_mode:
+        row["snippet_url"] = ""
+    inserted = supabase.table("messages").insert(row).execute().data[0]
+    history_cache.write(inserted)
+    mid = inserted["id"]
+    if voice_mode:
+        supabase.table("messages") \
+            .update({"snippet_url": f"/tts-stream/{mid}?snippet=0"}) \
+            .eq("id", mid) \
+            .execute()
+    return mid
+
+def insert_crisis_response(conv_id, voice_mode):
+    """Write the canned crisis reply immediately, ahead of the LLM's own response."""
+    return insert_assistant_reply(conv_id, CRISIS_RESPONSE, voice_mode)
+
+
+def handle_ai_record(msg, cancel=None):
     """
     Fetch a transcription-complete user message, generate an AI reply,
     and write either a streaming chat-mode record or a voice-mode
     record with a streaming snippet URL baked in.
+
+    `cancel` is an optional threading.Event set when a newer edit of this
+    message arrives; the reply is abandoned at the next checkpoint.
     """
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
     # skip anything we’ve already started
     if msg.get("ai_started"):
         return
     # mark it so no one else will re-run it
     supabase_admin.table("messages").update({"ai_started": True}).eq("id", msg["id"]).execute()
+    # usage for this turn (summaries, replies, continuations) is keyed by the user's message
+    usage.tag(message_id=msg["id"], conversation_id=msg["conversation_id"])
     print(f"💬 ⏳ Generating AI reply for message {msg['id']}…")
 
     try:
+        # 0) Local crisis pre-screen, before any network round trip
+        user_text = (msg.get("transcription") or "").strip()
+        crisis_match = crisis_screen(user_text)
+
         # 1) Figure out if Voice Mode is on
         conv = (
             supabase_admin
             .table("conversations")
-            .select("voice_enabled")
+            .select("voice_enabled,therapist_id")
             .eq("id", msg["conversation_id"])
             .single()
             .execute()
         )
         voice_mode = bool(conv.data.get("voice_enabled", False))
 
+        if crisis_match:
+            print(f"🚨 Crisis pre-screen matched “{crisis_match}” in message {msg['id']}")
+            insert_crisis_response(msg["conversation_id"], voice_mode)
+
+        # 1b) Definition questions already answered for this persona skip the LLM
+        answer_key = None
+        term = None if crisis_match else normalize_definition_query(user_text)
+        if term:
+            answer_key = (conv.data.get("therapist_id"), term)
+            cached = answer_cache.get(answer_key)
+            if cached is not None:
+                if cancelled():
+                    return
+                mid = insert_assistant_reply(msg["conversation_id"], cached, voice_mode)
+                supabase.table("messages") \
+                    .update({"ai_status": "done"}) \
+                    .eq("id", msg["id"]) \
+                    .execute()
+                print(f"⚡ Answered “{term}” for message {msg['id']} from cache ({mid})")
+                return
+
         # 2) Build the chat payload
-        payload = build_chat_payload(msg["conversation_id"], voice_mode=voice_mode)
+        with stage_timings.timed("payload"):
+            if answer_key:
+                payload = build_definition_payload(answer_key[0], user_text)
+            else:
+                payload = build_chat_payload(msg["conversation_id"], voice_mode=voice_mode)
+        if cancelled():
+            print(f"✋ Dropped stale reply for message {msg['id']} before generation")
+            return
 
         # ── MODEL SELECTION ──────────────────────────────────────────────
-        user_text = (msg.get("transcription") or "").strip()
         lc = user_text.lower()
 
-        if lc.startswith(("what is ", "define ")):
+        if crisis_match:
+            # the canned reply is already out; follow up with the strongest model
+            model_name, max_tokens = "gpt-4-turbo", 600
+        elif term:
+            # glossary definition: short, and shared through the answer cache
             model_name, max_tokens = "gpt-3.5-turbo", 150
         elif lc.startswith(("i feel", "i’m feeling", "i am feeling", "i am", "i'm")):
             model_name, max_tokens = "gpt-4-turbo", 600
@@ -333,6 +814,10 @@ def handle_ai_record(msg):
             else:
                 model_name, max_tokens = "gpt-3.5-turbo", 150
 
+        # under load, trade reply depth for bounded latency (never for crisis turns)
+        if not crisis_match:
+            model_name, max_tokens = ai_admission.adjust(model_name, max_tokens)
+
         print("Selected model:", model_name)
 
         # ── Generate and store assistant reply ────────────────────────────────────────
@@ -354,18 +839,30 @@ def handle_ai_record(msg):
             mid = insert_resp.data[0]["id"]
 
             # stream GPT
-            stream = openai_client.chat.completions.create(
+            generate_started = time.perf_counter()
+            stream = limiter.call(
+                "openai", model_name, CHAT, openai_client.chat.completions.create,
+                tokens=estimate_tokens(payload, max_tokens),
                 model=model_name,
                 messages=payload,
                 temperature=0.7,
                 stream=True,
+                stream_options={"include_usage": True},
                 max_tokens=max_tokens
             )
 
             accumulated = ""
             finish_reason = None
             for chunk in stream:
+                if cancelled():
+                    break
+                if not chunk.choices:
+                    # final chunk carries only the token usage for the whole stream
+                    usage.record_openai(chunk, model_name, "chat_reply")
+                    continue
                 delta = chunk.choices[0].delta.content or ""
+                if delta and not accumulated:
+                    stage_timings.observe("first_token", time.perf_counter() - generate_started)
                 accumulated += delta
                 if chunk.choices[0].finish_reason:
                     finish_reason = chunk.choices[0].finish_reason
@@ -373,15 +870,30 @@ def handle_ai_record(msg):
                     .update({"assistant_text": accumulated}) \
                     .eq("id", mid) \
                     .execute()
+            stage_timings.observe("generate", time.perf_counter() - generate_started)
+
+            if cancelled():
+                # hide the partial reply; the newer edit gets its own
+                stream.close()
+                supabase.table("messages") \
+                    .update({"ai_status": "done", "invalidated": True}) \
+                    .eq("id", mid) \
+                    .execute()
+                history_cache.write({"id": mid, "conversation_id": msg["conversation_id"], "invalidated": True})
+                print(f"✋ Abandoned stale reply {mid} for message {msg['id']}")
+                return
 
             # if truncated or cut off mid-sentence, fetch a continuation
             if finish_reason == "length" or not accumulated.strip().endswith((".", "!", "?")):
-                cont = openai_client.chat.completions.create(
+                cont = limiter.call(
+                    "openai", model_name, CHAT, openai_client.chat.completions.create,
+                    tokens=estimate_tokens(payload, 200) + len(accumulated) // 4,
                     model=model_name,
                     messages=payload + [{"role": "assistant", "content": accumulated}],
                     temperature=0.7,
                     max_tokens=200
                 )
+                usage.record_openai(cont, model_name, "continuation")
                 extra = cont.choices[0].message.content or ""
                 accumulated = accumulated.rstrip() + " " + extra.strip()
                 supabase.table("messages") \
@@ -394,21 +906,31 @@ def handle_ai_record(msg):
                 .update({"ai_status": "done"}) \
                 .eq("id", mid) \
                 .execute()
+            history_cache.write({**insert_resp.data[0], "assistant_text": accumulated, "ai_status": "done"})
+            if answer_key:
+                answer_cache.put(answer_key, accumulated, msg["id"], mid)
 
         else:
             # —— VOICE MODE: full GPT → streaming snippet URL ——
-            resp = openai_client.chat.completions.create(
+            # the crisis pre-screen already posted the hotline; don't let the model post it again
+            functions = {} if crisis_match else {"functions": FUNCTION_DEFS, "function_call": "auto"}
+            generate_started = time.perf_counter()
+            resp = limiter.call(
+                "openai", model_name, VOICE, openai_client.chat.completions.create,
+                tokens=estimate_tokens(payload, max_tokens),
                 model=model_name,
                 messages=payload,
                 temperature=0.7,
                 max_tokens=max_tokens,
-                functions=FUNCTION_DEFS,
-                function_call="auto"
+                **functions
             )
+            usage.record_openai(resp, model_name, "voice_reply")
+            stage_timings.observe("generate", time.perf_counter() - generate_started)
             choice = resp.choices[0].message
 
             # handle function calls (e.g. suicidal mentions)
             if getattr(choice, "function_call", None):
+                answer_key = None   # never reuse a safety response
                 args = json.loads(choice.function_call.arguments)
                 content = (
                     "I'm so sorry you’re feeling this way. "
@@ -421,18 +943,24 @@ def handle_ai_record(msg):
                 # if truncated or cut off mid-sentence, fetch continuation
                 finish_reason = resp.choices[0].finish_reason
                 if finish_reason == "length" or not content.strip().endswith((".", "!", "?")):
-                    cont = openai_client.chat.completions.create(
+                    cont = limiter.call(
+                        "openai", model_name, VOICE, openai_client.chat.completions.create,
+                        tokens=estimate_tokens(payload, 200) + len(content) // 4,
                         model=model_name,
                         messages=payload + [{"role": "assistant", "content": content}],
                         temperature=0.7,
                         max_tokens=200,
-                        functions=FUNCTION_DEFS,
-                        function_call="auto"
+                        **functions
                     )
+                    usage.record_openai(cont, model_name, "continuation")
                     cont_choice = cont.choices[0].message
                     extra = cont_choice.content or ""
                     content = content.rstrip() + " " + extra.lstrip()
 
+            if cancelled():
+                print(f"✋ Dropped stale voice reply for message {msg['id']}")
+                return
+
             # insert the full assistant_text, leave snippet_url blank
             insert_resp = (
                 supabase
@@ -448,6 +976,9 @@ def handle_ai_record(msg):
                 .execute()
             )
             mid = insert_resp.data[0]["id"]
+            history_cache.write(insert_resp.data[0])
+            if answer_key:
+                answer_cache.put(answer_key, content, msg["id"], mid)
 
             # seed the first snippet
             snippet_url = f"/tts-stream/{mid}?snippet=0"
@@ -481,12 +1012,181 @@ def handle_ai_record(msg):
 
 
 
+# ─── REALTIME EVENT INGESTION ───────────────────────────────────────────────
+COALESCE_WINDOW_S = 0.25    # bursts of events for one message within this window run once
+RECENT_IDS_MAX    = 4096    # how many completed (message, edit) versions we remember
+
+class EventIngestor:
+    """
+    Sits between the realtime callbacks and the executor.
+
+    Events are keyed by message id; a burst for the same id inside
+    COALESCE_WINDOW_S collapses into one job using the newest record.
+    A (message id, edited_at) version that is already in flight or was
+    completed recently is dropped, so duplicate UPDATEs never reach
+    handle_ai_record. Must be used from the event loop thread.
+    """
+
+    def __init__(self, loop, dispatch, window=COALESCE_WINDOW_S, max_recent=RECENT_IDS_MAX):
+        self.loop = loop
+        self.dispatch = dispatch        # msg -> future that resolves when the job is finished
+        self.window = window
+        self.max_recent = max_recent
+        self.pending = {}               # msg id -> newest record
+        self.in_flight = set()          # versions currently executing
+        self.recent = OrderedDict()     # LRU of completed versions
+        self.stats = {"received": 0, "coalesced": 0, "dropped": 0, "dispatched": 0}
+
+    @staticmethod
+    def version(msg):
+        return (msg["id"], msg.get("edited_at") or "")
+
+    def submit(self, msg):
+        self.stats["received"] += 1
+        key = self.version(msg)
+        if key in self.in_flight or key in self.recent:
+            self.stats["dropped"] += 1
+            return
+        if msg["id"] in self.pending:
+            self.stats["coalesced"] += 1
+            self.pending[msg["id"]] = msg
+            return
+        self.pending[msg["id"]] = msg
+        self.loop.call_later(self.window, self._flush, msg["id"])
+
+    def _flush(self, msg_id):
+        msg = self.pending.pop(msg_id, None)
+        if msg is None:
+            return
+        key = self.version(msg)
+        if key in self.in_flight or key in self.recent:
+            self.stats["dropped"] += 1
+            return
+        self.in_flight.add(key)
+        self.stats["dispatched"] += 1
+        fut = self.dispatch(msg)
+        fut.add_done_callback(lambda _f, key=key: self._done(key))
+
+    def _done(self, key):
+        self.in_flight.discard(key)
+        self.recent[key] = True
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.max_recent:
+            self.recent.popitem(last=False)
+
+
+# ─── PER-CONVERSATION LANES ─────────────────────────────────────────────────
+AI_WORKERS = int(os.getenv("AI_WORKERS", "8"))
+
+# load = (running + queued AI turns) / AI_WORKERS; see admission.py
+ai_admission = AdmissionController("ai", AI_WORKERS)
+
+class LaneScheduler:
+    """
+    Runs handle_ai_record on a shared pool with one lane per conversation:
+    turns of the same conversation run strictly in arrival order, different
+    conversations run in parallel.
+
+    A newer version of a message (an edit) replaces any queued copy and sets
+    the cancel event of a running one, so the stale generation stops at its
+    next checkpoint. Must be used from the event loop thread.
+    """
+
+    def __init__(self, loop, handler, max_workers=AI_WORKERS):
+        self.loop = loop
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-lane")
+        self.lanes = {}      # conversation id -> deque of (msg, cancel, future, queued at)
+        self.running = {}    # conversation id -> (msg, cancel)
+
+    def submit(self, msg):
+        conv_id = msg["conversation_id"]
+        fut = self.loop.create_future()
+        lane = self.lanes.setdefault(conv_id, deque())
+
+        for job in [j for j in lane if j[0]["id"] == msg["id"]]:
+            lane.remove(job)
+            job[2].set_result(None)
+        running = self.running.get(conv_id)
+        if running and running[0]["id"] == msg["id"]:
+            print(f"✋ Cancelling stale generation for message {msg['id']}")
+            running[1].set()
+
+        lane.append((msg, threading.Event(), fut, time.perf_counter()))
+        if conv_id not in self.running:
+            self._next(conv_id)
+        return fut
+
+    def _next(self, conv_id):
+        lane = self.lanes.get(conv_id)
+        if not lane:
+            self.lanes.pop(conv_id, None)
+            self.running.pop(conv_id, None)
+            return
+        msg, cancel, fut, queued_at = lane.popleft()
+        self.running[conv_id] = (msg, cancel)
+        ai_admission.enqueue()
+        job = self.loop.run_in_executor(self.executor, self._run, msg, cancel, queued_at)
+
+        def done(f):
+            if f.exception():
+                print(f"❌ Lane job for message {msg['id']} failed:", f.exception())
+            if not fut.done():
+                fut.set_result(None)
+            self._next(conv_id)
+        job.add_done_callback(done)
+
+    def _run(self, msg, cancel, queued_at):
+        # waiting behind earlier turns of the conversation and for a pool thread
+        stage_timings.observe("queue_wait", time.perf_counter() - queued_at)
+        ai_admission.start()
+        try:
+            with stage_timings.timed("turn"):
+                return self.handler(msg, cancel)
+        finally:
+            ai_admission.finish()
+
+
 # ─── ASYNC REALTIME SUBSCRIPTION ─────────────────────────────────────────────
-async def start_realtime():
-    supabase_async = await create_client_async(SUPABASE_URL, SERVICE_ROLE_KEY)
+RECONNECT_BASE_S     = 1      # first retry delay after the channel drops
+RECONNECT_MAX_S      = 60     # backoff ceiling
+BACKFILL_OVERLAP_S   = 5      # re-scan this far before the last event we saw
 
-    def on_insert(payload):
-        msg = payload["data"]["record"]
+def fetch_ai_backlog(since: str):
+    """
+    User turns still waiting for a reply that were created or edited at or
+    after `since` — whatever we may have missed while realtime was down.
+    updated_at is bumped on every update by the messages_touch_updated_at
+    trigger, so client edits (which only set edited_at) are included.
+    """
+    return (
+        supabase
+        .table("messages")
+        .select("*")
+        .eq("sender_role", "user")
+        .eq("ai_status", "pending")
+        .eq("transcription_status", "done")
+        .eq("ai_started", False)
+        .gte("updated_at", since)
+        .order("updated_at")
+        .execute()
+        .data
+        or []
+    )
+
+def route_event(event, msg, ingestor):
+    """
+    Apply one messages event (INSERT, UPDATE, or a BACKFILL row) to the
+    caches and hand any AI turn it starts to the ingestor. Shared by the
+    realtime callbacks and replay.py.
+    """
+    trace_recorder.record(event, msg)
+    if event == "BACKFILL":
+        ingestor.submit(msg)
+        return
+
+    history_cache.apply_event(msg)
+    if event == "INSERT":
         # only text messages (or audio after transcription) should trigger
         if (
         msg["sender_role"] == "user"
@@ -494,50 +1194,107 @@ async def start_realtime():
         and msg.get("transcription_status") == "done"
         and not msg.get("ai_started")
         ):
-            loop = asyncio.get_event_loop()
-            loop.run_in_executor(None, handle_ai_record, msg)
+            ingestor.submit(msg)
+        return
 
-    def on_update(payload):
+    if msg.get("invalidated"):
+        answer_cache.invalidate_message(msg["id"])
+    # only fire on a true client edit
+    if (
+    msg["sender_role"] == "user"
+    and msg.get("ai_status") == "pending"
+    and msg.get("edited_at")   # only set by your editMessage call
+    and not msg.get("ai_started")
+    ):
+        # the old wording's cached answer no longer belongs to this message
+        answer_cache.invalidate_message(msg["id"])
+        ingestor.submit(msg)
+
+async def start_realtime():
+    from realtime import RealtimeSubscribeStates
+    supabase_async = await create_supabase_async()
+    loop = asyncio.get_running_loop()
+    lanes = LaneScheduler(loop, handle_ai_record)
+    ingestor = EventIngestor(loop, lanes.submit)
+
+    # newest row timestamp observed over realtime; backfill starts from here
+    last_seen = START_TS
+    lost = asyncio.Event()
+    delay = RECONNECT_BASE_S
+    resubscribing = False
+    generation = 0      # bumped per channel; status events from older channels are ignored
+
+    def seen(msg):
+        nonlocal last_seen
+        ts = msg.get("updated_at") or msg.get("created_at")
+        if ts and ts > last_seen:
+            last_seen = ts
+
+    def on_insert(payload):
         msg = payload["data"]["record"]
-        # only fire on a true client edit
-        if (
-        msg["sender_role"] == "user"
-        and msg.get("ai_status") == "pending"
-        and msg.get("edited_at")   # only set by your editMessage call
-        and not msg.get("ai_started")
-        ):
-            loop = asyncio.get_event_loop()
-            loop.run_in_executor(None, handle_ai_record, msg)
+        seen(msg)
+        route_event("INSERT", msg, ingestor)
 
-    def on_subscribe(status, err):
+    def on_update(payload):
+        msg = payload["data"]["record"]
+        seen(msg)
+        route_event("UPDATE", msg, ingestor)
+
+    def on_subscribe(gen, status, err):
+        nonlocal delay, resubscribing
+        if gen != generation:
+            # e.g. the CLOSED that remove_channel() reports for the old channel
+            return
         if status == RealtimeSubscribeStates.SUBSCRIBED:
             print("🔌 SUBSCRIBED to messages_changes")
+            history_cache.set_enabled(True)
+            answer_cache.set_enabled(True)
+            delay = RECONNECT_BASE_S
+            if resubscribing:
+                # anything that arrived between the drop and now never reached us
+                resubscribing = False
+                loop.call_soon_threadsafe(lambda: loop.create_task(backfill()))
         else:
             print("❗ Realtime status:", status, err)
-    
-    def on_change(payload):
-        msg = payload["data"]["record"]
-        # only new user turns, never ones we’ve already kicked off
-        if (
-        msg["sender_role"] == "user"
-        and msg.get("ai_status") == "pending"
-        and not msg.get("ai_started")
-        ):
-            loop = asyncio.get_event_loop()
-            loop.run_in_executor(None, handle_ai_record, msg)
-
-    channel = supabase_async.channel("messages_changes")
-    channel.on_postgres_changes(event="INSERT", schema="public", table="messages", callback=on_insert)
-    channel.on_postgres_changes(event="UPDATE", schema="public", table="messages", callback=on_update)
-    await channel.subscribe(on_subscribe)
-
-    # Never close 
-    await asyncio.Event().wait()
+            history_cache.set_enabled(False)
+            answer_cache.set_enabled(False)
+            loop.call_soon_threadsafe(lost.set)
 
+    async def backfill():
+        try:
+            since = (datetime.fromisoformat(last_seen) - timedelta(seconds=BACKFILL_OVERLAP_S)).isoformat()
+            rows = await loop.run_in_executor(None, fetch_ai_backlog, since)
+        except Exception as e:
+            print("❌ Backfill failed:", e)
+            return
+        print(f"🩹 Backfill since {since}: {len(rows)} pending message(s)")
+        for msg in rows:
+            seen(msg)
+            route_event("BACKFILL", msg, ingestor)
+
+    while True:
+        lost.clear()
+        generation += 1
+        channel = supabase_async.channel("messages_changes")
+        channel.on_postgres_changes(event="INSERT", schema="public", table="messages", callback=on_insert)
+        channel.on_postgres_changes(event="UPDATE", schema="public", table="messages", callback=on_update)
+        try:
+            await channel.subscribe(lambda status, err, gen=generation: on_subscribe(gen, status, err))
+        except Exception as e:
+            print("❗ Realtime subscribe failed:", e)
+            lost.set()
 
+        await lost.wait()
+        resubscribing = True
 
-if __name__ == "__main__":
-    asyncio.run(start_realtime())
+        try:
+            await supabase_async.remove_channel(channel)
+        except Exception:
+            pass
+        jittered = delay * (0.5 + random.random() / 2)
+        print(f"🔁 Resubscribing to messages_changes in {jittered:.1f}s")
+        await asyncio.sleep(jittered)
+        delay = min(delay * 2, RECONNECT_MAX_S)
 
 
 # ─── Helpers ────────────────────────────────────────────────────────────────
@@ -557,6 +1314,28 @@ def download_audio(path, bucket="raw-audio"):
     url = supabase.storage.from_(bucket).create_signed_url(path, 60)["signedURL"]
     return storage_sess.get(url).content
 
+# embedded under patients in build_chat_payload's conversations query
+TREND_SELECT = "assessment_trends(assessment_name,latest_score,delta,rolling_avg,result_text,recent)"
+
+def format_trend_line(trends):
+    """
+    Compact one-line trend summary for the prompt, e.g.
+    "PHQ-9 14 (9→11→14, +3, avg 11.5, Moderate Depression); GAD-7 6 (avg 6, Mild Anxiety)"
+    """
+    parts = []
+    for t in trends:
+        details = []
+        recent = t.get("recent") or []
+        if len(recent) > 1:
+            details.append("→".join(str(r["score"]) for r in recent))
+        if t.get("delta") is not None:
+            details.append(f"{t['delta']:+d}")
+        details.append(f"avg {float(t['rolling_avg']):g}")
+        if t.get("result_text"):
+            details.append(t["result_text"])
+        parts.append(f"{t['assessment_name']} {t['latest_score']} ({', '.join(details)})")
+    return "; ".join(parts)
+
 def handle_suggest_assessment(call: dict):
     assessment_id = call["arguments"]["assessment_id"]
     name = call["arguments"]["assessment_name"]
@@ -604,12 +1383,16 @@ def summarize_and_store(conv_id):
     prompt = """
     You are a concise summarizer. Return a single plain noun phrase (≤8 words)that captures the conversation topic. Do NOT return a full sentence, no punctuation, no articles like “the” or “a”.
     """
-    resp = openai_client.chat.completions.create(
+    summary_messages = [{"role":"system", "content": prompt.strip()}] + msgs
+    resp = limiter.call(
+        "openai", "gpt-3.5-turbo", BACKGROUND, openai_client.chat.completions.create,
+        tokens=estimate_tokens(summary_messages, 30),
         model="gpt-3.5-turbo",
-        messages=[{"role":"system", "content": prompt.strip()}] + msgs,
+        messages=summary_messages,
         temperature=0.5,
         max_tokens=30,
     )
+    usage.record_openai(resp, "gpt-3.5-turbo", "memory_summary")
     raw = resp.choices[0].message.content.strip()
     # strip trailing period if any
     summary = raw.rstrip(".!?,;").strip()
@@ -641,12 +1424,25 @@ def close_inactive_conversations():
         or []
     )
 
-    for record in stale:
+    for i, record in enumerate(stale):
         conv_id = record["id"]
 
+        # summaries can wait; live turns can't
+        if not ai_admission.allow_background():
+            print(f"⏸️ Deferring {len(stale) - i} inactive conversation(s): worker is under load")
+            break
+
+        usage.tag(conversation_id=conv_id)
+
         # 2) generate & store summary (only if ≥4 assistant replies)
         summarize_and_store(conv_id)
 
+        # 2b) append the session's key moments to the patient's memory index
+        try:
+            index_conversation(conv_id)
+        except Exception as e:
+            print(f"❌ Failed to index memory for conv {conv_id}:", e)
+
         # 3) now mark it ended
         supabase.table("conversations") \
             .update({"ended": True}) \
@@ -668,6 +1464,7 @@ if __name__ == "__main__":
     # 1) One-off cleanup + schedule hourly
     close_inactive_conversations()
     schedule_cleanup(interval_hours=1)
+    schedule_metrics()
 
     # 2) Drain any pending rows left over from before restart
     #    (so transcription, AI, and TTS all pick up where they left off)